@@ -0,0 +1,258 @@
+# MIT License
+
+# Copyright (c) 2020-2021 ETH Zurich, Andrei V. Plamada
+# Copyright (c) 2020-2021 ETH Zurich, Elliott Ash
+# Copyright (c) 2020-2021 University of St.Gallen, Philine Widmer
+# Copyright (c) 2020-2021 Ecole Polytechnique, Germain Gauthier
+
+# Cache
+# ..................................................................................................................
+# ..................................................................................................................
+
+import hashlib
+import json
+import os
+import sqlite3
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+
+class SRLCache:
+
+    """
+
+    An on-disk cache of SRL results, stored in a SQLite database.
+
+    Results are keyed by a hash of the model and the sentence, so that one cache file may be shared by several models.
+
+    Args:
+        path: location of the SQLite database (created if it does not exist)
+        model: identifier of the SRL model (e.g. its path)
+
+    Example:
+        >>> cache = SRLCache(":memory:", model="srl-model.tar.gz")
+        >>> cache.get(['This is a house'])
+        [None]
+        >>> cache.set(['This is a house'], [{'words': ['This', 'is', 'a', 'house'], 'verbs': []}])
+        >>> cache.get(['This is a house', 'Hi'])
+        [{'words': ['This', 'is', 'a', 'house'], 'verbs': []}, None]
+        >>> len(cache)
+        1
+
+    """
+
+    # SQLite limits the number of variables in a single query
+    _chunk_size = 500
+
+    def __init__(self, path: str, model: str):
+        self._model = model
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS srl (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+
+    def _key(self, sentence: str) -> str:
+        return hashlib.sha256(
+            f"{self._model}\x00{sentence}".encode("utf-8")
+        ).hexdigest()
+
+    def get(self, sentences: List[str]) -> List[Optional[Dict[str, Any]]]:
+        keys = [self._key(sent) for sent in sentences]
+        found: Dict[str, str] = {}
+
+        for i in range(0, len(keys), self._chunk_size):
+            chunk = keys[i : i + self._chunk_size]
+            rows = self._conn.execute(
+                "SELECT key, value FROM srl WHERE key IN (%s)"
+                % ",".join("?" * len(chunk)),
+                chunk,
+            )
+            found.update(rows)
+
+        return [json.loads(found[key]) if key in found else None for key in keys]
+
+    def set(self, sentences: List[str], results: List[Dict[str, Any]]):
+        if len(sentences) != len(results):
+            raise ValueError("sentences and results should have the same length.")
+
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO srl (key, value) VALUES (?, ?)",
+                [
+                    (self._key(sent), json.dumps(res))
+                    for sent, res in zip(sentences, results)
+                ],
+            )
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM srl").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+
+class Fingerprint:
+
+    """
+
+    A hash of a sequence of texts (with their ids, if any), to check that a cache was built from the same corpus.
+
+    Example:
+        >>> a, b = Fingerprint(), Fingerprint()
+        >>> a.update('This is a house', doc_id=1)
+        >>> b.update('This is a house', doc_id=2)
+        >>> a.n, a.hexdigest() == b.hexdigest()
+        (1, False)
+
+    """
+
+    def __init__(self):
+        self.n = 0
+        self._hash = hashlib.sha256()
+
+    def update(self, text: str, doc_id: Any = None):
+        self.n += 1
+        self._hash.update(f"{doc_id}\x00{text}\x00".encode("utf-8"))
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
+class DocCache:
+
+    """
+
+    An on-disk cache of spaCy documents with their sentence boundaries and named entities, stored as DocBin shards.
+
+    The manifest is written last, so that an interrupted write leaves no cache behind. It holds fingerprints of the
+    documents and of their sentences, to check that the cache matches the corpus it is used with (see check_documents
+    and check_sentences).
+
+    Args:
+        path: directory of the cache (created if it does not exist)
+        shard_size: number of documents per DocBin shard
+
+    Example:
+        cache = DocCache("docs.spacy")
+        if not cache.exists():
+            cache.write(nlp.pipe(texts))
+        for doc in cache:
+            print(doc.user_data["id"], list(doc.sents), doc.ents)
+
+    """
+
+    attrs = ["SENT_START", "ENT_IOB", "ENT_TYPE"]
+
+    def __init__(self, path: str, shard_size: int = 10000):
+        self._path = path
+        self._shard_size = shard_size
+
+    @property
+    def _manifest_path(self) -> str:
+        return os.path.join(self._path, "manifest.json")
+
+    def exists(self) -> bool:
+        return os.path.isfile(self._manifest_path)
+
+    def _manifest(self) -> Dict[str, Any]:
+        if not self.exists():
+            raise ValueError(f"no document cache at {self._path}.")
+        with open(self._manifest_path) as f:
+            return json.load(f)
+
+    def write(self, docs: Iterable[Any]):
+        from spacy.tokens import DocBin
+
+        os.makedirs(self._path, exist_ok=True)
+        if self.exists():
+            os.remove(self._manifest_path)
+
+        shards: List[str] = []
+        doc_bin = DocBin(attrs=self.attrs, store_user_data=True)
+        doc_fingerprint, sent_fingerprint = Fingerprint(), Fingerprint()
+
+        def save(doc_bin):
+            shard = "%05d.spacy" % len(shards)
+            doc_bin.to_disk(os.path.join(self._path, shard))
+            shards.append(shard)
+
+        for doc in docs:
+            doc_bin.add(doc)
+            doc_fingerprint.update(doc.text, doc_id=doc.user_data.get("id"))
+            if doc.has_annotation("SENT_START"):
+                for sent in doc.sents:
+                    sent_fingerprint.update(sent.text)
+            if len(doc_bin) == self._shard_size:
+                save(doc_bin)
+                doc_bin = DocBin(attrs=self.attrs, store_user_data=True)
+        if len(doc_bin) > 0:
+            save(doc_bin)
+
+        with open(self._manifest_path, "w") as f:
+            json.dump(
+                {
+                    "n_docs": doc_fingerprint.n,
+                    "docs_sha256": doc_fingerprint.hexdigest(),
+                    "n_sentences": sent_fingerprint.n,
+                    "sentences_sha256": sent_fingerprint.hexdigest(),
+                    "shards": shards,
+                },
+                f,
+            )
+
+    def check_documents(self, docs: Iterable[Dict[str, Any]]):
+
+        """
+
+        Raise a ValueError if the cache was not built from these documents (dictionaries with keys "id" and "doc").
+
+        """
+
+        fingerprint = Fingerprint()
+        for doc in docs:
+            fingerprint.update(doc["doc"], doc_id=doc["id"])
+
+        manifest = self._manifest()
+        if (fingerprint.n, fingerprint.hexdigest()) != (
+            manifest["n_docs"],
+            manifest.get("docs_sha256"),
+        ):
+            raise ValueError(
+                f"the document cache at {self._path} was built from other documents "
+                f"({manifest['n_docs']} documents, {fingerprint.n} given)."
+            )
+
+    def check_sentences(self, sentences: Iterable[str]):
+
+        """
+
+        Raise a ValueError if these sentences are not the sentences of the cached documents.
+
+        """
+
+        fingerprint = Fingerprint()
+        for sentence in sentences:
+            fingerprint.update(sentence)
+
+        manifest = self._manifest()
+        if (fingerprint.n, fingerprint.hexdigest()) != (
+            manifest["n_sentences"],
+            manifest.get("sentences_sha256"),
+        ):
+            raise ValueError(
+                f"the document cache at {self._path} does not hold these sentences "
+                f"({manifest['n_sentences']} sentences, {fingerprint.n} given)."
+            )
+
+    def __iter__(self) -> Iterator[Any]:
+        from spacy.tokens import DocBin
+        from spacy.vocab import Vocab
+
+        # the strings of the documents are stored in the shards
+        vocab = Vocab()
+        for shard in self._manifest()["shards"]:
+            doc_bin = DocBin().from_disk(os.path.join(self._path, shard))
+            yield from doc_bin.get_docs(vocab)
+
+    def __len__(self) -> int:
+        return self._manifest()["n_docs"]
@@ -15,12 +15,8 @@ from collections import Counter
 from copy import deepcopy
 from typing import List, Optional, Union
 
-import gensim.downloader as api
 import numpy as np
-import tensorflow_hub as hub
-from gensim.models import Word2Vec
 from numpy.linalg import norm
-from sklearn.cluster import KMeans
 from tqdm import tqdm
 
 from .utils import count_values, count_words
@@ -62,6 +58,9 @@ class USE:
     """
 
     def __init__(self, path: str):
+        # tensorflow is imported on first use, not with relatio
+        import tensorflow_hub as hub
+
         self._embed = hub.load(path)
 
     def __call__(self, tokens: List[str]) -> np.ndarray:
@@ -97,6 +96,8 @@ class SIF_word2vec:
         self._normalize = normalize
 
     def _load_keyed_vectors(self, path):
+        from gensim.models import Word2Vec
+
         return Word2Vec.load(path).wv
 
     def __call__(self, tokens: List[str]):
@@ -128,6 +129,8 @@ class SIF_keyed_vectors(SIF_word2vec):
     """
 
     def _load_keyed_vectors(self, path):
+        import gensim.downloader as api
+
         return api.load(path)
 
 
@@ -237,6 +240,8 @@ def train_cluster_model(
 
     """
 
+    from sklearn.cluster import KMeans
+
     kmeans = KMeans(
         n_clusters=n_clusters, random_state=random_state, verbose=verbose
     ).fit(vecs)
@@ -9,9 +9,7 @@
 # ..................................................................................................................
 # ..................................................................................................................
 
-import matplotlib.pyplot as plt
-import networkx as nx
-from pyvis import network as net
+# networkx and pyvis are imported on first use, not with relatio
 
 
 def build_graph(  # to be considered as preliminary
@@ -24,6 +22,8 @@ def build_graph(  # to be considered as preliminary
     prune_network=True,
 ):
 
+    import networkx as nx
+
     # Network specifics
     G = nx.MultiDiGraph()
     if edge_size == None:
@@ -118,6 +118,8 @@ def draw_graph(
         only_physics_buttons: Show only buttons controlling physics of network?
     """
 
+    from pyvis import network as net
+
     # make a pyvis network
     pyvis_graph = net.Network(notebook=notebook, directed=True)
     pyvis_graph.width = "1000px"
@@ -12,19 +12,33 @@
 import time
 from collections import Counter
 from copy import deepcopy
-from typing import List, Optional, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 import numpy as np
-import spacy
 from tqdm import tqdm
 
-from .utils import clean_text, is_subsequence
+from .cache import DocCache
+from .utils import TextCleaner, get_spacy_model
 
-nlp = spacy.load("en_core_web_sm")
+
+def __getattr__(name: str):
+    # named_entity_recognition.nlp, the spaCy pipeline finding entities, is loaded on first access
+    if name == "nlp":
+        return get_spacy_model("en_core_web_sm")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _ner_disable(nlp) -> List[str]:
+    # components that are not the entity recognizer and that it does not listen to (e.g. a shared tok2vec)
+    return [
+        name
+        for name, pipe in nlp.pipeline
+        if name != "ner" and "ner" not in getattr(pipe, "listening_components", [])
+    ]
 
 
 def mine_entities(
-    sentences: List[str],
+    sentences: Optional[Iterable[str]],
     ent_labels: Optional[List[str]] = ["PERSON", "NORP", "ORG", "GPE", "EVENT"],
     remove_punctuation: bool = True,
     remove_digits: bool = True,
@@ -38,16 +52,28 @@ def mine_entities(
     tags_to_keep: Optional[List[str]] = None,
     remove_n_letter_words: Optional[int] = None,
     progress_bar: bool = False,
+    tag_sentences: bool = False,
+    batch_size: int = 1000,
+    n_process: int = 1,
+    doc_cache_path: Optional[str] = None,
 ) -> Counter:
 
     """
 
     A function that goes through sentences and counts named entities found in the corpus.
 
+    Only the named entity recognizer of the SpaCy pipeline is run.
+
     Args:
-        sentences: list of sentences
+        sentences: list of sentences (or any iterable of sentences, e.g. read lazily from disk)
         ent_labels: list of entity labels to be considered (see SpaCy documentation)
         progress_bar: print a progress bar (default is False)
+        batch_size: number of sentences processed together by SpaCy
+        n_process: number of processes running SpaCy (-1 for all CPUs, default is 1, i.e. this process only)
+        doc_cache_path: directory of a cache of the SpaCy documents (see utils.split_into_sentences), whose named entities
+        are counted instead of running SpaCy on the sentences (default is None, i.e. no cache). The sentences may then
+        be None; otherwise a ValueError is raised if they are not the sentences of the cached documents.
+        Entities are then found in whole documents rather than in each sentence.
         For other arguments see utils.clean_text.
 
     Returns:
@@ -55,21 +81,38 @@ def mine_entities(
 
     """
 
-    entities_all = []
+    if doc_cache_path is not None:
+        cache = DocCache(doc_cache_path)
+        if not cache.exists():
+            raise ValueError(
+                f"no document cache at {doc_cache_path} (see utils.split_into_sentences)."
+            )
+        if sentences is not None:
+            cache.check_sentences(sentences)
+        docs: Iterable[Any] = cache
+        total = len(cache)
+    else:
+        nlp = get_spacy_model("en_core_web_sm")
+        docs = nlp.pipe(
+            sentences,
+            batch_size=batch_size,
+            n_process=n_process,
+            disable=_ner_disable(nlp),
+        )
+        total = len(sentences) if hasattr(sentences, "__len__") else None
 
     if progress_bar:
         print("Mining named entities...")
         time.sleep(1)
-        sentences = tqdm(sentences)
+        docs = tqdm(docs, total=total)
 
-    for sentence in sentences:
-        sentence = nlp(sentence)
-        for ent in sentence.ents:
+    entities_all = []
+    for doc in docs:
+        for ent in doc.ents:
             if ent.label_ in ent_labels:
                 entities_all.append(ent.text)
 
-    entities_all = clean_text(
-        entities_all,
+    entities_all = TextCleaner(
         remove_punctuation,
         remove_digits,
         remove_chars,
@@ -81,7 +124,8 @@ def mine_entities(
         stem,
         tags_to_keep,
         remove_n_letter_words,
-    )
+        tag_sentences,
+    )(entities_all)
 
     # forgetting to remove those will break the pipeline
     entities_all = [entity for entity in entities_all if entity != ""]
@@ -91,12 +135,63 @@ def mine_entities(
     return entity_counts
 
 
+class EntityMatcher:
+
+    """
+
+    Find the named entities whose words all appear in a text, as is_subsequence(entity.split(), text.split()) does.
+
+    Each entity is indexed under the word it shares with the fewest other entities, so that a text is only checked
+    against the entities indexed under its own words.
+
+    Args:
+        entities: list of named entities
+
+    Example:
+        >>> matcher = EntityMatcher(['united states', 'states', 'europe'])
+        >>> matcher('the united states of america')
+        [0, 1]
+
+    """
+
+    def __init__(self, entities: List[str]):
+        self._entities = [frozenset(entity.split()) for entity in entities]
+        counts = Counter(word for words in self._entities for word in words)
+
+        self._index: Dict[str, List[int]] = {}
+        self._always: List[int] = []  # entities without words are in every text
+        for j, words in enumerate(self._entities):
+            if words:
+                key = min(words, key=lambda word: (counts[word], word))
+                self._index.setdefault(key, []).append(j)
+            else:
+                self._always.append(j)
+
+    def __call__(self, text: str) -> List[int]:
+
+        """
+
+        Positions of the entities found in the text, in the order of the entities.
+
+        """
+
+        words = set(text.split())
+        matches = list(self._always)
+        for word in words:
+            for j in self._index.get(word, ()):
+                if self._entities[j] <= words:
+                    matches.append(j)
+
+        return sorted(matches)
+
+
 def map_entities(  # the output could be a list of dictionaries (for consistency with the rest of the pipeline)
     statements: List[dict],
     entities: Counter,
     used_roles: List[str],
     top_n_entities: Optional[int] = None,
     progress_bar: bool = False,
+    sparse: bool = False,
 ) -> Tuple[dict, List[dict]]:
 
     """
@@ -108,18 +203,22 @@ def map_entities(  # the output could be a list of dictionaries (for consistency
         entities: user-defined list of named entities
         used_roles: list of semantic roles to be considered for named entity recognition
         progress_bar: print a progress bar (default is False)
+        sparse: return entity_index as sparse matrices (default is False)
 
     Returns:
-        entity_index: dictionary containing statements indices with entities for each role
+        entity_index: dictionary containing statements indices with entities for each role, or, if sparse is True,
+        a dictionary with the list of "entities" and, for each role, a boolean scipy CSR matrix of statements x entities
+        in "matrices" (e.g. entity_index["matrices"]["ARG0"].sum(axis=0) counts the statements with each entity)
         roles_copy: new list of postprocessed semantic roles (without the named entities mined since they will not be embedded)
 
     """
 
     entities_keys = [el[0] for el in entities.most_common(top_n_entities)]
+    matcher = EntityMatcher(entities_keys)
 
-    entity_index = {
-        role: {entity: np.asarray([], dtype=int) for entity in entities_keys}
-        for role in used_roles
+    # statement indices of each role and entity, turned into arrays at the end
+    matches: Dict[str, List[List[int]]] = {
+        role: [[] for _ in entities_keys] for role in used_roles
     }
 
     roles_copy = deepcopy(statements)
@@ -132,11 +231,35 @@ def map_entities(  # the output could be a list of dictionaries (for consistency
     for i, statement in enumerate(statements):
         for role, role_content in roles_copy[i].items():
             if role in used_roles:
-                for entity in entities_keys:
-                    if is_subsequence(entity.split(), role_content.split()) is True:
-                        entity_index[role][entity] = np.append(
-                            entity_index[role][entity], [i]
-                        )
-                        roles_copy[i][role] = ""
+                found = matcher(role_content)
+                for j in found:
+                    matches[role][j].append(i)
+                if found:
+                    roles_copy[i][role] = ""
+
+    if sparse:
+        from scipy.sparse import csr_matrix
+
+        entity_index = {"entities": entities_keys, "matrices": {}}
+        for role in used_roles:
+            rows = np.asarray(
+                [i for indices in matches[role] for i in indices], dtype=int
+            )
+            cols = np.repeat(
+                np.arange(len(entities_keys)), [len(el) for el in matches[role]]
+            )
+            entity_index["matrices"][role] = csr_matrix(
+                (np.ones(len(rows), dtype=bool), (rows, cols)),
+                shape=(len(roles_copy), len(entities_keys)),
+            )
+        return entity_index, roles_copy
+
+    entity_index = {
+        role: {
+            entity: np.asarray(matches[role][j], dtype=int)
+            for j, entity in enumerate(entities_keys)
+        }
+        for role in used_roles
+    }
 
     return entity_index, roles_copy
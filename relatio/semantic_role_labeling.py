@@ -12,22 +12,331 @@
 # link to choose the SRL model
 # https://storage.googleapis.com/allennlp-public-models/YOUR-PREFERRED-MODEL
 
+import json
+import multiprocessing
+import os
+import re
+import shutil
 import time
 import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
-from typing import Any, Dict, List, Optional, Tuple, Union
+from functools import lru_cache, partial
+from itertools import islice
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
 import numpy as np
-import torch
-from allennlp_models.structured_prediction.predictors import (
-    SemanticRoleLabelerPredictor as Predictor,
-)
 from tqdm import tqdm
 
-from .utils import clean_text, group_sentences_in_batches, replace_sentences
+from .cache import SRLCache
+from .storage import CompactSRL
+from .utils import (
+    TextCleaner,
+    group_sentences_in_batches,
+    map_in_chunks,
+    replace_sentences,
+    restore_order,
+    sort_sentences_by_length,
+)
+
+# torch, allennlp and spaCy are imported on first use, not with relatio
+if TYPE_CHECKING:
+    from allennlp_models.structured_prediction.predictors import (
+        SemanticRoleLabelerPredictor as Predictor,
+    )
+
+# predictors loaded in this process, by path, cuda_device and quantize (see load_predictor)
+_predictors: Dict[Tuple[str, int, Optional[str]], "Predictor"] = {}
+
+
+def load_predictor(
+    path: str,
+    cuda_device: int = -1,
+    quantize: Optional[str] = None,
+    reuse: bool = True,
+) -> "Predictor":
+
+    """
+
+    Load an AllenNLP SRL predictor.
+
+    Predictors are kept in a registry, so that loading the same model again in the same process is free.
+
+    Args:
+        path: location of the SRL model to be used (an archive or a snapshot, see save_predictor_snapshot)
+        cuda_device: GPU only, and it should be one of CUDA_VISIBLE_DEVICES (default is -1, i.e. CPU)
+        quantize: CPU only, "dynamic" to quantize the weights of the linear layers to int8 with torch dynamic quantization
+        (default is None, i.e. float weights)
+        reuse: return the predictor already loaded in this process, if any, and keep a newly loaded one in the registry
+        (default is True, otherwise the predictor is freed with its last reference)
+
+    Returns:
+        A SemanticRoleLabelerPredictor
+
+    """
+
+    if quantize not in [None, "dynamic"]:
+        raise ValueError("quantize is either None or dynamic.")
+
+    if quantize is not None and cuda_device > -1:
+        raise ValueError("quantize is only supported on CPU (cuda_device=-1).")
+
+    key = (path, cuda_device, quantize)
+    if reuse and key in _predictors:
+        return _predictors[key]
+
+    from allennlp_models.structured_prediction.predictors import (
+        SemanticRoleLabelerPredictor as Predictor,
+    )
+
+    predictor = Predictor.from_path(path, cuda_device=cuda_device)
+
+    if quantize == "dynamic":
+        import torch
+
+        predictor._model = torch.quantization.quantize_dynamic(
+            predictor._model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+
+    if reuse:
+        _predictors[key] = predictor
+
+    return predictor
+
+
+def clear_predictors():
+
+    """
+
+    Remove the predictors loaded in this process from the registry (see load_predictor), to free memory.
+
+    """
+
+    _predictors.clear()
+
+
+@lru_cache(maxsize=None)
+def _bert_tokenizer(path: str):
+    # the wordpiece tokenizer of the dataset reader of a model (None if not BERT-based), without loading the model
+    if os.path.isdir(path):
+        archive_dir = path
+    else:
+        from allennlp.common.file_utils import cached_path
+
+        archive_dir = cached_path(path, extract_archive=True)
+
+    with open(os.path.join(archive_dir, "config.json")) as f:
+        config = json.load(f)
+
+    bert_model_name = config.get("dataset_reader", {}).get("bert_model_name")
+    if bert_model_name is None:
+        return None
+
+    from transformers import BertTokenizer
+
+    return BertTokenizer.from_pretrained(bert_model_name)
+
+
+def save_predictor_snapshot(path: str, output_dir: str) -> str:
+
+    """
+
+    Save an SRL model archive as a snapshot: a directory with the extracted configuration, vocabulary and weights.
+
+    Loading a snapshot (e.g. SRL(path=output_dir)) skips downloading and unpacking the tar.gz archive.
+
+    Args:
+        path: location of the SRL model archive (local path or URL)
+        output_dir: directory of the snapshot (should not exist)
+
+    Returns:
+        The directory of the snapshot
+
+    """
+
+    from allennlp.common.file_utils import cached_path
+
+    shutil.copytree(cached_path(path, extract_archive=True), output_dir)
+
+    return output_dir
+
+
+# predictor of an SRL worker process (see SRL's num_workers)
+_worker_predictor = None
+# error loading the predictor of the worker, raised with its first batch
+_worker_error: Optional[BaseException] = None
+
+
+def _init_worker(path: str, num_threads: int, quantize: Optional[str]):
+    global _worker_predictor, _worker_error
+
+    # an initializer that raises makes multiprocessing.Pool start new workers forever
+    try:
+        import torch
+
+        torch.set_num_threads(num_threads)
+        _worker_predictor = load_predictor(path, cuda_device=-1, quantize=quantize)
+    except BaseException as err:
+        _worker_error = err
+
+
+def _predict_in_worker(batch: List[str]) -> List[Dict[str, List]]:
+    # not a RuntimeError, which would be taken for a failing batch
+    if _worker_error is not None:
+        raise ChildProcessError(
+            f"the SRL worker could not load the model: {_worker_error!r}"
+        )
+    return _worker_predictor.predict_batch_json([{"sentence": sent} for sent in batch])
+
+
+def _batch_stats(
+    index: int,
+    batch: List[str],
+    res_batch: List[Dict[str, List]],
+    forward_time: float,
+    cache_clear_time: float,
+) -> Dict[str, Any]:
+
+    """
+
+    Statistics on a batch of SRL.
+
+    Args:
+        index: position of the batch
+        batch: sentences of the batch
+        res_batch: SRL results of the batch
+        forward_time: seconds of the forward pass of the batch (waiting for the workers with num_workers)
+        cache_clear_time: seconds emptying the CUDA cache
+
+    Returns:
+        A dictionary with the statistics
+
+    Example:
+        >>> _batch_stats(0, ['Hi', 'I run'], [{'words': ['Hi'], 'verbs': []}, {'words': [], 'verbs': []}], 0.5, 0.0)
+        {'batch': 0, 'n_sentences': 2, 'n_tokens': 1, 'padding_ratio': 0.5, 'forward_time': 0.5, 'cache_clear_time': 0.0, 'failures': 1}
+
+    """
+
+    n_tokens = [len(r["words"]) for r in res_batch]
+    padded = len(n_tokens) * max(n_tokens, default=0)
+
+    return {
+        "batch": index,
+        "n_sentences": len(batch),
+        "n_tokens": sum(n_tokens),
+        "padding_ratio": 1 - sum(n_tokens) / padded if padded else 0.0,
+        "forward_time": forward_time,
+        "cache_clear_time": cache_clear_time,
+        # sentences with words but an empty result
+        "failures": sum(
+            bool(sent.split()) and not r["words"] for sent, r in zip(batch, res_batch)
+        ),
+    }
+
+
+def _result(decoded) -> Union[List[Dict[str, List]], RuntimeError]:
+    # result of a batch: a future, an AsyncResult of the worker pool or the error of the model,
+    # which is returned rather than raised so that the predictions of the next batches go on
+    if isinstance(decoded, RuntimeError):
+        return decoded
+    try:
+        return decoded.get() if hasattr(decoded, "get") else decoded.result()
+    except RuntimeError as err:
+        return err
+
+
+# links, user handles and hashtags, which are not verbs
+_NON_VERBS = re.compile(r"https?://\S+|www\.\S+|[@#]\w+")
+
+
+def has_verb_candidates(sentence: str) -> bool:
+
+    """
+
+    A cheap check that a sentence may contain a verb: it has a word (with letters) that is not a link, a handle or a hashtag.
+
+    Args:
+        sentence: a sentence
+
+    Returns:
+        False if the sentence surely has no verb, True otherwise
+
+    Example:
+        >>> has_verb_candidates('#climate @un https://t.co/xyz 2021')
+        False
+        >>> has_verb_candidates('Leaders meet in Paris #climate')
+        True
+
+    """
+
+    return any(c.isalpha() for c in _NON_VERBS.sub(" ", sentence))
+
+
+@lru_cache(maxsize=None)
+def _english_tokenizer():
+    # the rule-based tokenizer of the spaCy model used by the predictor
+    import spacy
+
+    return spacy.blank("en").tokenizer
+
+
+def _verbless_result(sentence: str) -> Dict[str, List]:
+    # the output of the predictor for a sentence without verbs
+    words = [word.text for word in _english_tokenizer()(sentence) if not word.is_space]
+    return {"verbs": [], "words": words}
 
 
 class SRL:
+
+    """
+
+    A class to run an AllenNLP semantic role labeling model on a list of sentences.
+
+    The batching options given at initialization are the defaults of __call__, which may override them.
+
+    Args:
+        path: location of the SRL model to be used
+        cuda_device: GPU only, and it should be one of CUDA_VISIBLE_DEVICES (default is -1, i.e. CPU)
+        max_batch_char_length: maximum number of characters in a batch (incompatible with batch_size)
+        batch_size: number of sentences in a batch
+        max_sentence_length: drop sentences with the length above this threshold
+        max_number_words: drop the sentences with the number of words above this threshold
+        max_batch_tokens: maximum number of sentences times the number of wordpieces of the longest sentence in a batch,
+        counted with the model tokenizer (incompatible with max_batch_char_length and batch_size)
+        cuda_empty_cache: empty the CUDA cache after each batch
+        cuda_sleep: seconds to sleep after emptying the CUDA cache
+        sort_by_length: batch sentences of similar number of words together to reduce padding (results keep the input order)
+        sort_window: number of consecutive sentences sorted together (default is None, i.e. all sentences)
+        cache_path: location of a SQLite cache of SRL results, checked before inference and filled afterwards (default is None, i.e. no cache)
+        num_workers: CPU only, number of worker processes, each with its own predictor (default is None, i.e. a single predictor in this process).
+        Worker processes are spawned, so scripts using them should be guarded by `if __name__ == "__main__":`.
+        They are stopped by close, or at the end of a `with SRL(...) as srl:` block.
+        torch_num_threads: number of torch intra-op threads of each worker (default is the number of CPUs divided by num_workers)
+        bisect_on_error: when a batch raises a RuntimeError (e.g. out of memory), split it in halves until the failing sentences are isolated,
+        and halve the budget of later batches if the failure came from the size of the batch, i.e. if both halves of a failing batch succeeded
+        (default is False, i.e. the whole output is replaced with empty results)
+        pipeline: prepare the next batch (tokenization, POS tagging, indexing) and decode the previous one in background threads
+        while the model runs on the current batch (incompatible with num_workers)
+        quantize: CPU only, "dynamic" to run the model with int8 linear layers (see load_predictor and benchmark_quantization)
+        reuse_predictor: reuse the predictor already loaded in this process for the same path, cuda_device and quantize,
+        or share the loaded one with later models (default is True, see load_predictor)
+        skip_verbless: give an empty result without running the model to sentences that surely have no verb,
+        e.g. links, hashtags or numbers only (see has_verb_candidates). The number of skipped sentences is kept in n_skipped.
+
+    """
+
     def __init__(
         self,
         path: str,
@@ -36,20 +345,317 @@ class SRL:
         batch_size: Optional[int] = None,
         max_sentence_length: Optional[int] = None,
         max_number_words: Optional[int] = None,
+        max_batch_tokens: Optional[int] = None,
         cuda_empty_cache: bool = True,
         cuda_sleep: float = 0.0,
+        sort_by_length: bool = False,
+        sort_window: Optional[int] = None,
+        cache_path: Optional[str] = None,
+        num_workers: Optional[int] = None,
+        torch_num_threads: Optional[int] = None,
+        bisect_on_error: bool = False,
+        pipeline: bool = False,
+        quantize: Optional[str] = None,
+        reuse_predictor: bool = True,
+        skip_verbless: bool = False,
     ):
-        self._predictor = Predictor.from_path(path, cuda_device=cuda_device)
+        if num_workers is not None and cuda_device > -1:
+            raise ValueError("num_workers is only supported on CPU (cuda_device=-1).")
+
+        if num_workers is not None and pipeline:
+            raise ValueError("num_workers and pipeline are mutually exclusive.")
+
+        if num_workers is not None:
+            if torch_num_threads is None:
+                torch_num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+            self._predictor = None
+            self._num_workers = num_workers
+            self._pool = multiprocessing.get_context("spawn").Pool(
+                num_workers,
+                initializer=_init_worker,
+                initargs=(path, torch_num_threads, quantize),
+            )
+        else:
+            self._predictor = load_predictor(
+                path, cuda_device=cuda_device, quantize=quantize, reuse=reuse_predictor
+            )
+            self._pool = None
+
+        self._path = path
+        # quantized models do not share cached results with float ones
+        model = path if quantize is None else f"{path}#{quantize}"
+        self._cache = SRLCache(cache_path, model=model) if cache_path else None
         self._max_batch_char_length = max_batch_char_length
         self._batch_size = batch_size
         self._max_sentence_length = max_sentence_length
         self._max_number_words = max_number_words
+        self._max_batch_tokens = max_batch_tokens
         self._cuda_empty_cache = cuda_empty_cache
         self._cuda_device = cuda_device
         self._cuda_sleep = cuda_sleep
+        self._sort_by_length = sort_by_length
+        self._sort_window = sort_window
+        self._bisect_on_error = bisect_on_error
+        self._pipeline = pipeline
+        self._skip_verbless = skip_verbless
+        self.n_skipped = 0  # number of sentences skipped by skip_verbless
+        self.n_labeled = 0  # number of sentences given to the model (or the cache)
+
+    def close(self):
+
+        """
+
+        Stop the worker processes, if any.
+
+        """
+
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _count_tokens(self, sentence: str) -> int:
+        # words are split by spaCy, then into wordpieces by BERT-based models
+        # (with num_workers, only the tokenizers are loaded in this process)
+        if self._predictor is not None:
+            bert_tokenizer = getattr(
+                self._predictor._dataset_reader, "bert_tokenizer", None
+            )
+            tokenizer = self._predictor._tokenizer.spacy.tokenizer
+        else:
+            bert_tokenizer = _bert_tokenizer(self._path)
+            tokenizer = _english_tokenizer()
+
+        if bert_tokenizer is not None:
+            return len(bert_tokenizer.tokenize(sentence))
+
+        return sum(not word.is_space for word in tokenizer(sentence))
+
+    def _predict_batch(self, batch: List[str]) -> List[Dict[str, List]]:
+        if self._pool is not None:
+            return self._pool.apply(_predict_in_worker, (batch,))
+        return self._predictor.predict_batch_json(
+            [{"sentence": sent} for sent in batch]
+        )
+
+    # The three steps of SemanticRoleLabelerPredictor.predict_batch_json, run separately by the pipeline
+
+    def _prepare_batch(self, batch: List[str]) -> Tuple[List, List]:
+        tokens = [self._predictor._tokenizer.tokenize(sent) for sent in batch]
+        instances = [self._predictor.tokens_to_instances(t) for t in tokens]
+        return tokens, instances
+
+    def _forward_batch(self, instances: List[List]) -> List[Dict[str, Any]]:
+        # as in predict_batch_json, the model runs on as many verbs as there are sentences at once
+        flattened = [instance for instances_ in instances for instance in instances_]
+        size = max(len(instances), 1)
+        outputs: List[Dict[str, Any]] = []
+        for i in range(0, len(flattened), size):
+            outputs.extend(
+                self._predictor._model.forward_on_instances(flattened[i : i + size])
+            )
+        return outputs
+
+    def _decode_batch(
+        self, tokens: List[List], instances: List[List], outputs: List[Dict[str, Any]]
+    ) -> List[Dict[str, List]]:
+        res = []
+        outputs_iter = iter(outputs)
+        for sentence_tokens, sentence_instances in zip(tokens, instances):
+            # sentences without verbs keep their tokens
+            res_sentence: Dict[str, Any] = {"verbs": [], "words": sentence_tokens}
+            for _ in sentence_instances:
+                output = next(outputs_iter)
+                res_sentence["words"] = output["words"]
+                res_sentence["verbs"].append(
+                    {
+                        "verb": output["verb"],
+                        "description": self._predictor.make_srl_string(
+                            output["words"], output["tags"]
+                        ),
+                        "tags": output["tags"],
+                    }
+                )
+            res.append(res_sentence)
+        from allennlp.common.util import sanitize
+
+        return sanitize(res)
+
+    def _predict_serial(
+        self, batches: List[List[str]]
+    ) -> Iterator[Tuple[Union[List[Dict[str, List]], RuntimeError], float]]:
+
+        """
+
+        Yield the results of each batch, or the RuntimeError of the model on the batch, with the seconds of its forward pass.
+
+        """
+
+        for batch in batches:
+            start = time.perf_counter()
+            try:
+                res_batch = self._predict_batch(batch)
+            except RuntimeError as err:
+                res_batch = err
+            yield res_batch, time.perf_counter() - start
+
+    def _predict_in_pool(
+        self, batches: List[List[str]]
+    ) -> Iterator[Tuple[Union[List[Dict[str, List]], RuntimeError], float]]:
+
+        """
+
+        Yield the results of each batch, or the RuntimeError of the model on the batch, like _predict_serial,
+        with the seconds waiting for the workers.
+
+        Batches go to whichever worker is free, at most two per worker at a time, so that the batches not labeled yet
+        when the generator is closed (e.g. to group the remaining sentences again) are not labeled twice.
+
+        """
+
+        batches = iter(batches)
+        pending = deque(
+            self._pool.apply_async(_predict_in_worker, (batch,))
+            for batch in islice(batches, 2 * self._num_workers)
+        )
+        try:
+            while pending:
+                decoded = pending.popleft()
+                for batch in islice(batches, 1):
+                    pending.append(self._pool.apply_async(_predict_in_worker, (batch,)))
+                start = time.perf_counter()
+                res_batch = _result(decoded)
+                yield res_batch, time.perf_counter() - start
+        finally:
+            # the workers finish the batches already sent before labeling new ones
+            for decoded in pending:
+                decoded.wait()
+
+    def _predict_pipelined(
+        self, batches: List[List[str]]
+    ) -> Iterator[Tuple[Union[List[Dict[str, List]], RuntimeError], float]]:
+
+        """
+
+        Yield the results of each batch, or the RuntimeError of the model on the batch, like _predict_serial,
+        with the seconds of its own forward pass.
+
+        While the model runs on a batch, the next batch is prepared and the previous one decoded in background threads.
+
+        """
+
+        with ThreadPoolExecutor(max_workers=1) as preparer, ThreadPoolExecutor(
+            max_workers=1
+        ) as decoder:
+            next_prepared = preparer.submit(self._prepare_batch, batches[0])
+            decoded_previous = None
+            forward_time_previous = 0.0
+
+            for i in range(len(batches)):
+                prepared = next_prepared
+                if i + 1 < len(batches):
+                    next_prepared = preparer.submit(self._prepare_batch, batches[i + 1])
+
+                start = time.perf_counter()
+                try:
+                    tokens, instances = prepared.result()
+                    start = time.perf_counter()
+                    outputs = self._forward_batch(instances)
+                except RuntimeError as err:
+                    decoded = err
+                else:
+                    decoded = decoder.submit(
+                        self._decode_batch, tokens, instances, outputs
+                    )
+                forward_time = time.perf_counter() - start
+
+                if decoded_previous is not None:
+                    yield _result(decoded_previous), forward_time_previous
+                decoded_previous = decoded
+                forward_time_previous = forward_time
+
+                # an error is handed over before the next forward pass (e.g. to empty the CUDA cache)
+                if isinstance(decoded, RuntimeError):
+                    yield decoded, forward_time
+                    decoded_previous = None
+
+            if decoded_previous is not None:
+                yield _result(decoded_previous), forward_time_previous
+
+    def _predict_bisect(
+        self, batch: List[str], cuda_sleep: float, cuda_empty_cache: bool
+    ) -> Tuple[List[Dict[str, List]], bool]:
+
+        """
+
+        Label a batch that raised a RuntimeError by splitting it in halves, recursively.
+
+        Only the sentences that fail on their own get an empty result. Also tells whether the failure came from the size
+        of the batch (both halves of a failing batch succeeded) rather than from sentences failing on their own.
+
+        Example:
+            A model failing on batches of more than two sentences, and on a sentence with BAD:
+
+            >>> import warnings
+            >>> class StubPredictor:
+            ...     def predict_batch_json(self, inputs):
+            ...         if len(inputs) > 2 or any('BAD' in x['sentence'] for x in inputs):
+            ...             raise RuntimeError('out of memory')
+            ...         return [{'words': x['sentence'].split(), 'verbs': []} for x in inputs]
+            >>> _predictors[('stub', -1, None)] = StubPredictor()
+            >>> srl = SRL('stub', batch_size=4, bisect_on_error=True)
+            >>> stats = []
+            >>> with warnings.catch_warnings():
+            ...     warnings.simplefilter('ignore')
+            ...     res = srl(['a', 'b', 'c', 'd', 'e', 'f', 'BAD', 'g', 'h', 'i'], callback=stats.append)
+            >>> [r['words'] for r in res]
+            [['a'], ['b'], ['c'], ['d'], ['e'], ['f'], [], ['g'], ['h'], ['i']]
+
+            The first batch failed because of its size, so later batches have half the budget,
+            which the sentence failing on its own does not reduce:
+
+            >>> [s['n_sentences'] for s in stats]
+            [4, 2, 2, 2]
+            >>> clear_predictors()
+
+        """
+
+        if len(batch) == 1:
+            warnings.warn(f"empty result for {batch[0]!r}", RuntimeWarning)
+            return [{"words": [], "verbs": []}], False
+
+        res: List[Dict[str, List]] = []
+        n_failed = 0
+        size_dependent = False
+        half = len(batch) // 2
+        for sub_batch in (batch[:half], batch[half:]):
+            try:
+                res_sub_batch = self._predict_batch(sub_batch)
+            except RuntimeError:
+                res_sub_batch = None
+            finally:
+                self._clean_cache(cuda_sleep, cuda_empty_cache)
+
+            if res_sub_batch is None:
+                n_failed += 1
+                res_sub_batch, sub_size_dependent = self._predict_bisect(
+                    sub_batch, cuda_sleep, cuda_empty_cache
+                )
+                size_dependent = size_dependent or sub_size_dependent
+            res.extend(res_sub_batch)
+
+        return res, size_dependent or n_failed == 0
 
     def _clean_cache(self, cuda_sleep, cuda_empty_cache):
         if self._cuda_device > -1 and cuda_empty_cache:
+            import torch
+
             with torch.cuda.device(self._cuda_device):
                 torch.cuda.empty_cache()
                 time.sleep(cuda_sleep)
@@ -61,10 +667,34 @@ class SRL:
         batch_size: Optional[int] = None,
         max_sentence_length: Optional[int] = None,
         max_number_words: Optional[int] = None,
+        max_batch_tokens: Optional[int] = None,
         cuda_empty_cache: bool = None,
         cuda_sleep: float = None,
+        sort_by_length: Optional[bool] = None,
+        sort_window: Optional[int] = None,
+        skip_verbless: Optional[bool] = None,
+        callback: Optional[Callable[[Dict[str, Any]], Any]] = None,
         progress_bar: bool = False,
     ):
+
+        """
+
+        Run SRL on a list of sentences.
+
+        Batching options default to the ones given at initialization (see SRL).
+
+        Args:
+            sentences: list of sentences
+            callback: function called after each batch with a dictionary of statistics on the batch:
+            number of sentences and tokens (words), padding ratio, seconds of the forward pass and emptying the CUDA cache,
+            and number of sentences with an empty result after an error (see _batch_stats)
+            progress_bar: print a progress bar (default is False)
+
+        Returns:
+            A list of dictionaries with the SRL output
+
+        """
+
         max_batch_char_length = (
             max_batch_char_length
             if max_batch_char_length is not None
@@ -83,50 +713,394 @@ class SRL:
             max_number_words if max_number_words is not None else self._max_number_words
         )
 
+        max_batch_tokens = (
+            max_batch_tokens if max_batch_tokens is not None else self._max_batch_tokens
+        )
+
         cuda_empty_cache = (
             cuda_empty_cache if cuda_empty_cache is not None else self._cuda_empty_cache
         )
 
         cuda_sleep = cuda_sleep if cuda_sleep is not None else self._cuda_sleep
 
+        sort_by_length = (
+            sort_by_length if sort_by_length is not None else self._sort_by_length
+        )
+
+        sort_window = sort_window if sort_window is not None else self._sort_window
+
+        skip_verbless = (
+            skip_verbless if skip_verbless is not None else self._skip_verbless
+        )
+
         sentences = replace_sentences(
             sentences,
             max_sentence_length=max_sentence_length,
             max_number_words=max_number_words,
         )
 
-        batches = group_sentences_in_batches(
-            sentences,
+        if skip_verbless:
+            candidates = [
+                i for i, sent in enumerate(sentences) if has_verb_candidates(sent)
+            ]
+            n_skipped = len(sentences) - len(candidates)
+            self.n_skipped += n_skipped
+
+            if progress_bar:
+                print(
+                    f"Skipped {n_skipped} of {len(sentences)} sentences without verbs."
+                )
+
+            if n_skipped:
+                res_candidates = self(
+                    [sentences[i] for i in candidates],
+                    max_batch_char_length=max_batch_char_length,
+                    batch_size=batch_size,
+                    max_batch_tokens=max_batch_tokens,
+                    cuda_empty_cache=cuda_empty_cache,
+                    cuda_sleep=cuda_sleep,
+                    sort_by_length=sort_by_length,
+                    sort_window=sort_window,
+                    skip_verbless=False,
+                    callback=callback,
+                    progress_bar=progress_bar,
+                )
+
+                # empty results after a RuntimeError
+                if len(res_candidates) != len(candidates):
+                    return res_candidates
+
+                res_candidates = dict(zip(candidates, res_candidates))
+                return [
+                    res_candidates[i] if i in res_candidates else _verbless_result(sent)
+                    for i, sent in enumerate(sentences)
+                ]
+
+        self.n_labeled += len(sentences)
+
+        if self._cache is None:
+            return self._run(
+                sentences,
+                max_batch_char_length=max_batch_char_length,
+                batch_size=batch_size,
+                max_batch_tokens=max_batch_tokens,
+                cuda_empty_cache=cuda_empty_cache,
+                cuda_sleep=cuda_sleep,
+                sort_by_length=sort_by_length,
+                sort_window=sort_window,
+                callback=callback,
+                progress_bar=progress_bar,
+            )
+
+        res = self._cache.get(sentences)
+
+        # sentences missing from the cache are labeled once, even if repeated
+        missing = list(dict.fromkeys(s for s, r in zip(sentences, res) if r is None))
+
+        if progress_bar:
+            print(f"Found {len(sentences) - len(missing)} sentences in the SRL cache.")
+
+        res_missing = self._run(
+            missing,
             max_batch_char_length=max_batch_char_length,
             batch_size=batch_size,
+            max_batch_tokens=max_batch_tokens,
+            cuda_empty_cache=cuda_empty_cache,
+            cuda_sleep=cuda_sleep,
+            sort_by_length=sort_by_length,
+            sort_window=sort_window,
+            callback=callback,
+            progress_bar=progress_bar,
         )
 
+        # empty results after a RuntimeError are not cached
+        if len(res_missing) != len(missing):
+            return res_missing
+
+        # blank results of the sentences that failed on their own are not cached
+        done = [
+            i
+            for i, (s, r) in enumerate(zip(missing, res_missing))
+            if r["words"] or not s.split()
+        ]
+        self._cache.set([missing[i] for i in done], [res_missing[i] for i in done])
+        res_missing = dict(zip(missing, res_missing))
+
+        return [r if r is not None else res_missing[s] for s, r in zip(sentences, res)]
+
+    def stream(
+        self, sentences: Iterable[str], chunk_size: int = 10_000, **kwargs
+    ) -> Iterator[List[Dict[str, List]]]:
+
+        """
+
+        Run SRL on an iterable of sentences, chunk by chunk, so that memory does not grow with the corpus.
+
+        Each chunk gets exactly one result per sentence: a RuntimeError is raised if a batch failed without bisect_on_error.
+
+        Args:
+            sentences: iterable of sentences (e.g. a generator reading a file)
+            chunk_size: number of sentences read and labeled at once
+            kwargs: see __call__
+
+        Returns:
+            An iterator over the SRL results of each chunk, in the order of the sentences
+
+        """
+
+        if chunk_size < 1:
+            raise ValueError("chunk_size should be a positive integer.")
+
+        sentences = iter(sentences)
+        while True:
+            chunk = list(islice(sentences, chunk_size))
+            if not chunk:
+                break
+            res = self(chunk, **kwargs)
+            if len(res) != len(chunk):
+                raise RuntimeError(
+                    f"SRL gave {len(res)} results for a chunk of {len(chunk)} sentences "
+                    "after a failing batch (see bisect_on_error)."
+                )
+            yield res
+
+    def _run(
+        self,
+        sentences: List[str],
+        max_batch_char_length: Optional[int],
+        batch_size: Optional[int],
+        max_batch_tokens: Optional[int],
+        cuda_empty_cache: bool,
+        cuda_sleep: float,
+        sort_by_length: bool,
+        sort_window: Optional[int],
+        callback: Optional[Callable[[Dict[str, Any]], Any]],
+        progress_bar: bool,
+    ) -> List[Dict[str, List]]:
+        # sentences of similar length are batched together to reduce padding
+        if sort_by_length:
+            order = sort_sentences_by_length(sentences, window=sort_window)
+            sentences = [sentences[i] for i in order]
+
+        # longer sentences are replaced with an empty string, whatever the batch budget
+        if max_batch_char_length is not None:
+            sentences = replace_sentences(
+                sentences, max_sentence_length=max_batch_char_length
+            )
+
+        if max_batch_tokens is not None:
+            count_tokens = lru_cache(maxsize=None)(self._count_tokens)
+            sentences = [
+                "" if count_tokens(sent) > max_batch_tokens else sent
+                for sent in sentences
+            ]
+        else:
+            count_tokens = None
+
         res: List[Dict[str, List]] = []
 
         if progress_bar:
             print("Running SRL...")
             time.sleep(1)
-            batches = tqdm(batches)
-
-        for batch in batches:
-            sentences_json = [{"sentence": sent} for sent in batch]
-            try:
-                res_batch = self._predictor.predict_batch_json(sentences_json)
-            except RuntimeError as err:
-                warnings.warn(f"empty result {err}", RuntimeWarning)
-                res = [{"words": [], "verbs": []}] * len(batch)
-                break
-            except:
-                raise
-            finally:
+            pbar = tqdm(total=len(sentences))
+
+        labeled = 0  # number of sentences with a result
+        n_batches = 0
+        while labeled < len(sentences):
+            batches = group_sentences_in_batches(
+                sentences[labeled:],
+                max_batch_char_length=max_batch_char_length,
+                batch_size=batch_size,
+                max_batch_tokens=max_batch_tokens,
+                count_tokens=count_tokens,
+            )
+
+            if self._pool is not None:
+                # batches go to whichever worker is free, results come back in order
+                predictions = self._predict_in_pool(batches)
+            elif self._pipeline and batches:
+                predictions = self._predict_pipelined(batches)
+            else:
+                predictions = self._predict_serial(batches)
+
+            for batch in batches:
+                shrink_budget = False
+                failed = False
+                res_batch, forward_time = next(predictions)
+                if isinstance(res_batch, RuntimeError):
+                    err = res_batch
+                    if not self._bisect_on_error:
+                        warnings.warn(f"empty result {err}", RuntimeWarning)
+                        res_batch = [{"words": [], "verbs": []}] * len(batch)
+                        failed = True
+                    else:
+                        # the model runs on the halves of the batch
+                        start = time.perf_counter()
+                        warnings.warn(f"splitting batch after {err}", RuntimeWarning)
+                        self._clean_cache(cuda_sleep, cuda_empty_cache)
+                        res_batch, shrink_budget = self._predict_bisect(
+                            batch, cuda_sleep, cuda_empty_cache
+                        )
+                        forward_time += time.perf_counter() - start
+
+                start = time.perf_counter()
                 self._clean_cache(cuda_sleep, cuda_empty_cache)
+                cache_clear_time = time.perf_counter() - start
+
+                if callback is not None:
+                    callback(
+                        _batch_stats(
+                            n_batches, batch, res_batch, forward_time, cache_clear_time
+                        )
+                    )
+                n_batches += 1
+
+                if failed:
+                    res = res_batch
+                    labeled = len(sentences)
+                    break
+
+                res.extend(res_batch)
+                labeled += len(batch)
+
+                if progress_bar:
+                    pbar.update(len(batch))
+
+                # the remaining sentences are grouped again with half the budget, unless the batch
+                # only failed because of sentences failing on their own
+                # (with num_workers, batches already sent to the workers are discarded)
+                if shrink_budget:
+                    remaining = sentences[labeled:]
+                    if max_batch_char_length is not None:
+                        max_batch_char_length = max(
+                            max_batch_char_length // 2,
+                            max(map(len, remaining), default=0),
+                        )
+                    if batch_size is not None:
+                        batch_size = max(batch_size // 2, 1)
+                    if max_batch_tokens is not None:
+                        max_batch_tokens = max(
+                            max_batch_tokens // 2,
+                            max(map(count_tokens, remaining), default=0),
+                        )
+                    break
+
+            predictions.close()
+
+        if progress_bar:
+            pbar.close()
+
+        # after a RuntimeError res holds only empty results, which need no reordering
+        if sort_by_length and len(res) == len(sentences):
+            res = restore_order(res, order)
 
-            res.extend(res_batch)
         return res
 
 
+def compare_srl(
+    srl_res: List[Dict[str, Any]], reference: List[Dict[str, Any]]
+) -> Dict[str, float]:
+
+    """
+
+    Agreement of SRL results with reference results on the same sentences (e.g. of a quantized model with the float model).
+
+    Args:
+        srl_res: srl output
+        reference: reference srl output
+
+    Returns:
+        A dictionary with the share of sentences with identical results, the share of sentences with the same verbs,
+        and the share of identical tags over the sentences with the same verbs
+
+    Example:
+        >>> reference = [{'words': ['I', 'run'], 'verbs': [{'verb': 'run', 'tags': ['B-ARG0', 'B-V']}]}, {'words': ['Hi'], 'verbs': []}]
+        >>> srl_res = [{'words': ['I', 'run'], 'verbs': [{'verb': 'run', 'tags': ['O', 'B-V']}]}, {'words': ['Hi'], 'verbs': []}]
+        >>> compare_srl(srl_res, reference)
+        {'sentence_agreement': 0.5, 'verb_agreement': 1.0, 'tag_agreement': 0.5}
+
+    """
+
+    if len(srl_res) != len(reference):
+        raise ValueError("srl_res and reference should have the same length.")
+
+    same_sentences = same_verbs = same_tags = n_tags = 0
+
+    for sentence_dict, reference_dict in zip(srl_res, reference):
+        verbs = [verb["verb"] for verb in sentence_dict["verbs"]]
+        reference_verbs = [verb["verb"] for verb in reference_dict["verbs"]]
+
+        same_sentence = verbs == reference_verbs
+        if same_sentence:
+            same_verbs += 1
+            for verb, reference_verb in zip(
+                sentence_dict["verbs"], reference_dict["verbs"]
+            ):
+                tags, reference_tags = verb["tags"], reference_verb["tags"]
+                n_tags += max(len(tags), len(reference_tags))
+                same_tags += sum(t == r for t, r in zip(tags, reference_tags))
+                same_sentence = same_sentence and tags == reference_tags
+        same_sentences += same_sentence
+
+    n_sentences = len(reference)
+
+    return {
+        "sentence_agreement": same_sentences / n_sentences if n_sentences else 1.0,
+        "verb_agreement": same_verbs / n_sentences if n_sentences else 1.0,
+        "tag_agreement": same_tags / n_tags if n_tags else 1.0,
+    }
+
+
+def benchmark_quantization(
+    path: str, sentences: List[str], warmup_size: int = 8, **kwargs
+) -> Dict[str, float]:
+
+    """
+
+    Compare the speed and the results of a dynamically quantized SRL model with the float model on CPU.
+
+    Each model is loaded on its own (not kept in the registry of load_predictor) and runs on the first warmup_size
+    sentences before being timed.
+
+    Args:
+        path: location of the SRL model to be used
+        sentences: held-out sample of sentences
+        warmup_size: number of sentences labeled by each model before timing
+        kwargs: batching options (see SRL), without cache_path
+
+    Returns:
+        A dictionary with the seconds taken by each model, the speedup and the agreement of the results (see compare_srl)
+
+    """
+
+    if kwargs.get("cache_path") is not None:
+        raise ValueError("benchmark_quantization does not support cache_path.")
+
+    kwargs["reuse_predictor"] = False
+
+    res: Dict[str, float] = {}
+    srl_res = {}
+
+    for quantize in [None, "dynamic"]:
+        with SRL(path, quantize=quantize, **kwargs) as srl:
+            srl(sentences[:warmup_size])
+            start = time.perf_counter()
+            srl_res[quantize] = srl(sentences)
+            res["float_time" if quantize is None else "quantized_time"] = (
+                time.perf_counter() - start
+            )
+        del srl
+
+    res["speedup"] = res["float_time"] / res["quantized_time"]
+    res.update(compare_srl(srl_res["dynamic"], srl_res[None]))
+
+    return res
+
+
 def extract_roles(
-    srl: List[Dict[str, Any]], used_roles: List[str], progress_bar: bool = False
+    srl: Union[List[Dict[str, Any]], CompactSRL],
+    used_roles: List[str],
+    progress_bar: bool = False,
 ) -> Tuple[List[Dict[str, Union[str, bool]]], List[int]]:
 
     """
@@ -134,7 +1108,7 @@ def extract_roles(
     A function that extracts semantic roles from the SRL output.
 
     Args:
-        srl: srl output
+        srl: srl output (list of dictionaries or storage.CompactSRL)
         used_roles: list of semantic roles to extract
         progress_bar: print a progress bar (default is False)
 
@@ -159,6 +1133,16 @@ def extract_roles(
     return statements_role_list, np.asarray(sentence_index, dtype=np.uint32)
 
 
+# roles decoded from the tags, in the order of the statement dictionaries
+_DECODED_ROLES = ("ARG0", "ARG1", "ARG2", "B-V", "B-ARGM-MOD", "B-ARGM-NEG")
+
+
+@lru_cache(maxsize=None)
+def _roles_in_tag(tag: str, roles: Tuple[str, ...]) -> Tuple[str, ...]:
+    # e.g. "R-ARG1" contains "ARG1" (the tag vocabulary is small, so this is cached)
+    return tuple(role for role in roles if role in tag)
+
+
 def extract_role_per_sentence(
     sentence_dict: dict, used_roles: List[str]
 ) -> List[Dict[str, Union[str, bool]]]:
@@ -174,33 +1158,42 @@ def extract_role_per_sentence(
     Returns:
         List of statements with their associated roles for a given sentence
 
+    Example:
+        >>> sentence_dict = {'words': ['I', 'did', 'not', 'say', 'that', 'it', 'will', 'fail'], 'verbs': [{'verb': 'say', 'tags': ['B-ARG0', 'O', 'B-ARGM-NEG', 'B-V', 'B-ARG1', 'I-ARG1', 'I-ARG1', 'I-ARG1']}, {'verb': 'fail', 'tags': ['O', 'O', 'O', 'O', 'O', 'B-ARG1', 'B-ARGM-MOD', 'B-V']}]}
+        >>> extract_role_per_sentence(sentence_dict, ['ARG0', 'B-V', 'B-ARGM-NEG', 'B-ARGM-MOD', 'ARG1', 'ARG2'])
+        [{'ARG0': 'I', 'ARG1': 'that it will fail', 'B-V': 'say', 'B-ARGM-NEG': True}, {'ARG1': 'it', 'B-V': 'fail', 'B-ARGM-MOD': 'will'}]
+        >>> extract_role_per_sentence({'words': ['Hi'], 'verbs': []}, ['ARG0'])
+        [{}]
+
     """
 
     word_list = sentence_dict["words"]
     sentence_role_list = []
 
+    roles = tuple(role for role in _DECODED_ROLES if role in used_roles)
+
     for statement_dict in sentence_dict["verbs"]:
-        tag_list = statement_dict["tags"]
-
-        statement_role_dict: Dict[str, Union[str, bool]] = {}
-        for role in ["ARG0", "ARG1", "ARG2", "B-V", "B-ARGM-MOD"]:
-            if role in used_roles:
-                indices_role = [i for i, tok in enumerate(tag_list) if role in tok]
-                toks_role = [
-                    tok for i, tok in enumerate(word_list) if i in indices_role
-                ]
-                statement_role_dict[role] = " ".join(toks_role)
-
-        if "B-ARGM-NEG" in used_roles:
-            role_negation_value = any("B-ARGM-NEG" in tag for tag in tag_list)
-            statement_role_dict["B-ARGM-NEG"] = role_negation_value
-
-        key_to_delete = []
-        for key, value in statement_role_dict.items():
-            if not value:
-                key_to_delete.append(key)
-        for key in key_to_delete:
-            del statement_role_dict[key]
+        words_role: Dict[str, List[str]] = {role: [] for role in roles}
+        negation = False
+
+        # single pass over the tags of the verb
+        for i, tag in enumerate(statement_dict["tags"]):
+            for role in _roles_in_tag(tag, roles):
+                if role == "B-ARGM-NEG":
+                    negation = True
+                elif i < len(word_list):
+                    words_role[role].append(word_list[i])
+
+        statement_role_dict: Dict[str, Union[str, bool]] = {
+            role: " ".join(words_role[role]) for role in roles if role != "B-ARGM-NEG"
+        }
+
+        if "B-ARGM-NEG" in roles:
+            statement_role_dict["B-ARGM-NEG"] = negation
+
+        statement_role_dict = {
+            key: value for key, value in statement_role_dict.items() if value
+        }
         sentence_role_list.append(statement_role_dict)
 
     if not sentence_role_list:
@@ -209,6 +1202,41 @@ def extract_role_per_sentence(
     return sentence_role_list
 
 
+def _clean_roles(
+    statements: List[Dict[str, Any]],
+    cleaner: TextCleaner,
+    max_length: Optional[int] = None,
+    progress_bar: bool = False,
+) -> List[Dict[str, Any]]:
+    roles_copy = deepcopy(statements)
+
+    if progress_bar:
+        statements = tqdm(statements)
+
+    for i, statement in enumerate(statements):
+        text_roles = []
+        for role, role_content in roles_copy[i].items():
+            if isinstance(role_content, str):
+                text_roles.append(role)
+            elif isinstance(role_content, bool):
+                pass
+            else:
+                raise ValueError(f"{role_content}")
+
+        # the roles of a statement are cleaned (and tagged) together
+        cleaned = cleaner([roles_copy[i][role] for role in text_roles])
+        for role, res in zip(text_roles, cleaned):
+            if max_length is not None:
+                if len(res) <= max_length:
+                    roles_copy[i][role] = res
+                else:
+                    roles_copy[i][role] = ""
+            else:
+                roles_copy[i][role] = res
+
+    return roles_copy
+
+
 def process_roles(
     statements: List[Dict[str, List]],
     max_length: Optional[int] = None,
@@ -224,6 +1252,8 @@ def process_roles(
     tags_to_keep: Optional[List[str]] = None,
     remove_n_letter_words: Optional[int] = None,
     progress_bar: bool = False,
+    tag_sentences: bool = False,
+    n_jobs: Optional[int] = None,
 ) -> List[Dict[str, List]]:
 
     """
@@ -233,50 +1263,42 @@ def process_roles(
     Args:
         max_length = remove roles of more than n characters (NB: very long roles tend to be uninformative)
         progress_bar: print a progress bar (default is False)
-        For other arguments see utils.clean_text.
+        n_jobs: number of processes cleaning chunks of statements (-1 for all CPUs, default is None, i.e. this process only)
+        For other arguments see utils.clean_text (with tag_sentences, the roles of a statement are tagged together).
 
     Returns:
         List of processed statements
 
     """
 
-    roles_copy = deepcopy(statements)
+    cleaner = TextCleaner(
+        remove_punctuation=remove_punctuation,
+        remove_digits=remove_digits,
+        remove_chars=remove_chars,
+        stop_words=stop_words,
+        lowercase=lowercase,
+        strip=strip,
+        remove_whitespaces=remove_whitespaces,
+        lemmatize=lemmatize,
+        stem=stem,
+        tags_to_keep=tags_to_keep,
+        remove_n_letter_words=remove_n_letter_words,
+        tag_sentences=tag_sentences,
+    )
 
     if progress_bar:
         print("Cleaning SRL...")
         time.sleep(1)
-        statements = tqdm(statements)
 
-    for i, statement in enumerate(statements):
-        for role, role_content in roles_copy[i].items():
-            if isinstance(role_content, str):
-                res = clean_text(
-                    [role_content],
-                    remove_punctuation=remove_punctuation,
-                    remove_digits=remove_digits,
-                    remove_chars=remove_chars,
-                    stop_words=stop_words,
-                    lowercase=lowercase,
-                    strip=strip,
-                    remove_whitespaces=remove_whitespaces,
-                    lemmatize=lemmatize,
-                    stem=stem,
-                    tags_to_keep=tags_to_keep,
-                    remove_n_letter_words=remove_n_letter_words,
-                )[0]
-                if max_length is not None:
-                    if len(res) <= max_length:
-                        roles_copy[i][role] = res
-                    else:
-                        roles_copy[i][role] = ""
-                else:
-                    roles_copy[i][role] = res
-            elif isinstance(role_content, bool):
-                pass
-            else:
-                raise ValueError(f"{role_content}")
+    if n_jobs is None or n_jobs == 1:
+        return _clean_roles(statements, cleaner, max_length, progress_bar)
 
-    return roles_copy
+    return map_in_chunks(
+        partial(_clean_roles, cleaner=cleaner, max_length=max_length),
+        statements,
+        n_jobs=n_jobs,
+        progress_bar=progress_bar,
+    )
 
 
 def rename_arguments(
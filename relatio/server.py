@@ -0,0 +1,278 @@
+# MIT License
+
+# Copyright (c) 2020-2021 ETH Zurich, Andrei V. Plamada
+# Copyright (c) 2020-2021 ETH Zurich, Elliott Ash
+# Copyright (c) 2020-2021 University of St.Gallen, Philine Widmer
+# Copyright (c) 2020-2021 Ecole Polytechnique, Germain Gauthier
+
+# Local SRL Server
+# ..................................................................................................................
+# ..................................................................................................................
+
+import json
+import queue
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+
+from .semantic_role_labeling import SRL, _verbless_result, has_verb_candidates
+from .utils import replace_sentences
+
+
+class _Request:
+    def __init__(self, sentences: List[str]):
+        self.sentences = sentences
+        self.done = threading.Event()
+        self.res: Optional[List[Dict[str, List]]] = None
+        self.error: Optional[Exception] = None
+
+
+class SRLServer:
+
+    """
+
+    A local HTTP server hosting SRL models, shared by many jobs (see SRLClient).
+
+    Requests arriving within max_wait seconds of each other are labeled together, so that the batches of the model
+    (see utils.group_sentences_in_batches) are filled with sentences of concurrent requests.
+
+    Args:
+        models: dictionary of SRL models, by name
+        host: host of the server (default is localhost only)
+        port: port of the server (default is 8000, 0 picks a free port)
+        max_wait: seconds to wait for concurrent requests before running the model
+
+    Example:
+        server = SRLServer({"default": SRL(path, batch_size=64, bisect_on_error=True)})
+        server.serve_forever()
+
+    """
+
+    def __init__(
+        self,
+        models: Dict[str, SRL],
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        max_wait: float = 0.01,
+    ):
+        self._models = models
+        self._queues: Dict[str, queue.Queue] = {name: queue.Queue() for name in models}
+        self._max_wait = max_wait
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+
+        self._batchers = [
+            threading.Thread(target=self._batch_requests, args=(name,), daemon=True)
+            for name in models
+        ]
+        for batcher in self._batchers:
+            batcher.start()
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def shutdown(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        for requests in self._queues.values():
+            requests.put(None)
+        for batcher in self._batchers:
+            batcher.join()
+
+    def _label(self, model: str, sentences: List[str]) -> List[Dict[str, List]]:
+        request = _Request(sentences)
+        self._queues[model].put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.res
+
+    def _batch_requests(self, model: str):
+        srl, requests = self._models[model], self._queues[model]
+
+        while True:
+            request = requests.get()
+            if request is None:
+                return
+
+            # requests arriving within max_wait are labeled together
+            batch = [request]
+            deadline = time.monotonic() + self._max_wait
+            while True:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is None:
+                    requests.put(None)
+                    break
+                batch.append(request)
+
+            sentences = [sent for request in batch for sent in request.sentences]
+
+            try:
+                res = srl(sentences)
+            except Exception as err:
+                for request in batch:
+                    request.error = err
+                    request.done.set()
+                continue
+
+            start = 0
+            for request in batch:
+                if len(res) == len(sentences):
+                    request.res = res[start : start + len(request.sentences)]
+                else:
+                    # the model replaced the whole output with empty results
+                    request.res = [{"words": [], "verbs": []}] * len(request.sentences)
+                start += len(request.sentences)
+                request.done.set()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                try:
+                    body = json.loads(
+                        self.rfile.read(int(self.headers["Content-Length"]))
+                    )
+                    model = body.get("model", "default")
+                    if model not in server._models:
+                        self._respond(404, {"error": f"unknown model {model}"})
+                        return
+                    sentences = replace_sentences(
+                        body["sentences"],
+                        max_sentence_length=body.get("max_sentence_length"),
+                        max_number_words=body.get("max_number_words"),
+                    )
+                    self._respond(200, {"srl_res": server._label(model, sentences)})
+                except Exception as err:
+                    self._respond(500, {"error": repr(err)})
+
+            def _respond(self, status: int, content: dict):
+                data = json.dumps(content).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class SRLClient:
+
+    """
+
+    A client of an SRLServer, called like SRL.
+
+    Batching is done by the server: the batching options of __call__ (and callback, since batches are run by the server)
+    raise a ValueError if they are set. With skip_verbless, sentences without verb candidates are not sent to the server.
+
+    Args:
+        url: url of the server (e.g. SRLServer.url)
+        model: name of the model on the server
+        timeout: seconds to wait for the server (default is None, i.e. no timeout)
+
+    """
+
+    def __init__(
+        self, url: str, model: str = "default", timeout: Optional[float] = None
+    ):
+        self._url = url.rstrip("/")
+        self._model = model
+        self._timeout = timeout
+
+    def __call__(
+        self,
+        sentences: List[str],
+        max_batch_char_length: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        max_sentence_length: Optional[int] = None,
+        max_number_words: Optional[int] = None,
+        max_batch_tokens: Optional[int] = None,
+        cuda_empty_cache: bool = None,
+        cuda_sleep: float = None,
+        sort_by_length: Optional[bool] = None,
+        sort_window: Optional[int] = None,
+        skip_verbless: Optional[bool] = None,
+        callback: Optional[Callable[[Dict[str, Any]], Any]] = None,
+        progress_bar: bool = False,
+    ) -> List[Dict[str, List]]:
+        batching_options = {
+            "max_batch_char_length": max_batch_char_length,
+            "batch_size": batch_size,
+            "max_batch_tokens": max_batch_tokens,
+            "cuda_empty_cache": cuda_empty_cache,
+            "cuda_sleep": cuda_sleep,
+            "sort_by_length": sort_by_length,
+            "sort_window": sort_window,
+        }
+        unsupported = [
+            name
+            for name, value in batching_options.items()
+            if value is not None and value is not False
+        ]
+        if unsupported:
+            raise ValueError(
+                f"{', '.join(unsupported)} should be set on the models of the server."
+            )
+        if callback is not None:
+            raise ValueError("callback is not supported by SRLClient.")
+
+        sentences = list(sentences)
+
+        if skip_verbless:
+            # as in SRL, long sentences are replaced before looking for verbs
+            sentences = replace_sentences(
+                sentences,
+                max_sentence_length=max_sentence_length,
+                max_number_words=max_number_words,
+            )
+            candidates = [
+                i for i, sent in enumerate(sentences) if has_verb_candidates(sent)
+            ]
+            res_candidates = dict(
+                zip(
+                    candidates,
+                    self([sentences[i] for i in candidates]),
+                )
+            )
+            return [
+                res_candidates[i] if i in res_candidates else _verbless_result(sent)
+                for i, sent in enumerate(sentences)
+            ]
+
+        data = {
+            "model": self._model,
+            "sentences": sentences,
+            "max_sentence_length": max_sentence_length,
+            "max_number_words": max_number_words,
+        }
+        request = urllib.request.Request(
+            self._url + "/srl",
+            data=json.dumps(data).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request, timeout=self._timeout) as response:
+            return json.loads(response.read())["srl_res"]
+
+    stream = SRL.stream
+    __enter__ = SRL.__enter__
+    __exit__ = SRL.__exit__
+
+    def close(self):
+        pass
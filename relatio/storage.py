@@ -0,0 +1,250 @@
+# MIT License
+
+# Copyright (c) 2020-2021 ETH Zurich, Andrei V. Plamada
+# Copyright (c) 2020-2021 ETH Zurich, Elliott Ash
+# Copyright (c) 2020-2021 University of St.Gallen, Philine Widmer
+# Copyright (c) 2020-2021 Ecole Polytechnique, Germain Gauthier
+
+# Storage of SRL Output
+# ..................................................................................................................
+# ..................................................................................................................
+
+import json
+import os
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List
+
+import numpy as np
+
+MANIFEST = "manifest.json"
+
+
+def _write_atomic(path: str, lines: List[str]):
+    # a crash while writing leaves the previous version of the file untouched
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.writelines(lines)
+    os.replace(tmp_path, path)
+
+
+def load_manifest(output_dir: str) -> Dict[str, Any]:
+
+    """
+
+    Load the manifest of a directory of SRL shards (an empty manifest if there is none yet).
+
+    Args:
+        output_dir: directory of the shards
+
+    Returns:
+        A dictionary with the list of completed shards and the number of sentences they hold
+
+    """
+
+    path = os.path.join(output_dir, MANIFEST)
+
+    if not os.path.isfile(path):
+        return {"n_sentences": 0, "shards": []}
+
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def write_srl_shard(
+    output_dir: str, srl_res: List[Dict[str, Any]], manifest: Dict[str, Any]
+):
+
+    """
+
+    Write SRL results to a new JSONL shard, then record the shard in the manifest.
+
+    Args:
+        output_dir: directory of the shards
+        srl_res: SRL results of consecutive sentences
+        manifest: manifest of the directory (see load_manifest), updated in place
+
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    filename = "srl_res_%05d.jsonl" % len(manifest["shards"])
+    _write_atomic(
+        os.path.join(output_dir, filename),
+        [json.dumps(res) + "\n" for res in srl_res],
+    )
+
+    manifest["shards"].append({"file": filename, "n_sentences": len(srl_res)})
+    manifest["n_sentences"] += len(srl_res)
+    _write_atomic(os.path.join(output_dir, MANIFEST), [json.dumps(manifest)])
+
+
+def iter_srl_shards(output_dir: str) -> Iterator[Dict[str, Any]]:
+
+    """
+
+    Iterate over the SRL results stored in the completed shards of a directory, in the order of the sentences.
+
+    Args:
+        output_dir: directory of the shards
+
+    Returns:
+        An iterator over the SRL results (one dictionary per sentence)
+
+    Example:
+        >>> import tempfile
+        >>> output_dir = tempfile.mkdtemp()
+        >>> manifest = load_manifest(output_dir)
+        >>> write_srl_shard(output_dir, [{'words': ['Hi'], 'verbs': []}], manifest)
+        >>> write_srl_shard(output_dir, [{'words': ['Hello'], 'verbs': []}], manifest)
+        >>> load_manifest(output_dir)['n_sentences']
+        2
+        >>> list(iter_srl_shards(output_dir))
+        [{'words': ['Hi'], 'verbs': []}, {'words': ['Hello'], 'verbs': []}]
+
+    """
+
+    for shard in load_manifest(output_dir)["shards"]:
+        with open(os.path.join(output_dir, shard["file"]), "r") as f:
+            for line in f:
+                yield json.loads(line)
+
+
+class CompactSRL:
+
+    """
+
+    A compact, columnar representation of the SRL output.
+
+    Words, verbs and tags are coded as integers and concatenated in flat arrays, with offsets per sentence and per verb.
+    It behaves like the list of dictionaries returned by SRL (e.g. for extract_roles), with the exception that the
+    "description" of each verb is not stored.
+
+    Saved as a directory of .npy files, which can be memory-mapped when loaded.
+
+    Example:
+        >>> srl_res = [{'words': ['Hi'], 'verbs': []}, {'words': ['I', 'run'], 'verbs': [{'verb': 'run', 'description': '[ARG0: I] [V: run]', 'tags': ['B-ARG0', 'B-V']}]}]
+        >>> compact_srl = CompactSRL.from_srl(srl_res)
+        >>> len(compact_srl)
+        2
+        >>> compact_srl[1]
+        {'words': ['I', 'run'], 'verbs': [{'verb': 'run', 'tags': ['B-ARG0', 'B-V']}]}
+        >>> import tempfile
+        >>> path = tempfile.mkdtemp()
+        >>> compact_srl.save(path)
+        >>> list(CompactSRL.load(path)) == list(compact_srl)
+        True
+
+    """
+
+    _arrays = [
+        "word_ids",
+        "word_offsets",
+        "verb_ids",
+        "verb_offsets",
+        "tag_ids",
+        "tag_offsets",
+    ]
+
+    def __init__(
+        self,
+        words: List[str],
+        tags: List[str],
+        word_ids: np.ndarray,
+        word_offsets: np.ndarray,
+        verb_ids: np.ndarray,
+        verb_offsets: np.ndarray,
+        tag_ids: np.ndarray,
+        tag_offsets: np.ndarray,
+    ):
+        self.words = words  # vocabulary of words
+        self.tags = tags  # vocabulary of tags
+        self.word_ids = word_ids  # words of all sentences
+        self.word_offsets = word_offsets  # start of the words of each sentence
+        self.verb_ids = verb_ids  # verbs of all sentences
+        self.verb_offsets = verb_offsets  # start of the verbs of each sentence
+        self.tag_ids = tag_ids  # tags of all verbs
+        self.tag_offsets = tag_offsets  # start of the tags of each verb
+
+    @classmethod
+    def from_srl(cls, srl_res: Iterable[Dict[str, Any]]) -> "CompactSRL":
+
+        """
+
+        Build the compact representation from the SRL output (a list or any iterable, e.g. iter_srl_shards).
+
+        """
+
+        words: Dict[str, int] = {}
+        tags: Dict[str, int] = {}
+        word_ids, word_offsets = array("l"), array("q", [0])
+        verb_ids, verb_offsets = array("l"), array("q", [0])
+        tag_ids, tag_offsets = array("l"), array("q", [0])
+
+        for sentence_dict in srl_res:
+            word_ids.extend(
+                words.setdefault(w, len(words)) for w in sentence_dict["words"]
+            )
+            word_offsets.append(len(word_ids))
+            for verb_dict in sentence_dict["verbs"]:
+                verb_ids.append(words.setdefault(verb_dict["verb"], len(words)))
+                tag_ids.extend(tags.setdefault(t, len(tags)) for t in verb_dict["tags"])
+                tag_offsets.append(len(tag_ids))
+            verb_offsets.append(len(verb_ids))
+
+        return cls(
+            list(words),
+            list(tags),
+            np.asarray(word_ids, dtype=np.int32),
+            np.asarray(word_offsets, dtype=np.int64),
+            np.asarray(verb_ids, dtype=np.int32),
+            np.asarray(verb_offsets, dtype=np.int64),
+            np.asarray(tag_ids, dtype=np.int16),
+            np.asarray(tag_offsets, dtype=np.int64),
+        )
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "vocabulary.json"), "w") as f:
+            json.dump({"words": self.words, "tags": self.tags}, f)
+        for name in self._arrays:
+            np.save(os.path.join(path, name + ".npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "CompactSRL":
+        with open(os.path.join(path, "vocabulary.json"), "r") as f:
+            vocabulary = json.load(f)
+        arrays = {
+            name: np.load(
+                os.path.join(path, name + ".npy"), mmap_mode="r" if mmap else None
+            )
+            for name in cls._arrays
+        }
+        return cls(vocabulary["words"], vocabulary["tags"], **arrays)
+
+    def __len__(self) -> int:
+        return len(self.word_offsets) - 1
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        if not -len(self) <= i < len(self):
+            raise IndexError("CompactSRL index out of range")
+        i = i % len(self)
+
+        start, end = self.word_offsets[i], self.word_offsets[i + 1]
+        verbs = []
+        for v in range(self.verb_offsets[i], self.verb_offsets[i + 1]):
+            tag_ids = self.tag_ids[self.tag_offsets[v] : self.tag_offsets[v + 1]]
+            verbs.append(
+                {
+                    "verb": self.words[self.verb_ids[v]],
+                    "tags": [self.tags[t] for t in tag_ids],
+                }
+            )
+
+        return {
+            "words": [self.words[w] for w in self.word_ids[start:end]],
+            "verbs": verbs,
+        }
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for i in range(len(self)):
+            yield self[i]
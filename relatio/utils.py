@@ -10,56 +10,451 @@
 # ..................................................................................................................
 
 import json
+import multiprocessing
+import os
 import re
 import string
+import subprocess
+import sys
 import time
-from collections import Counter
-from typing import Dict, List, Optional, Tuple
+from collections import Counter, OrderedDict
+from functools import lru_cache
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
 import pandas as pd
-import spacy
-from nltk import pos_tag
-from nltk.corpus import wordnet
-from nltk.stem import SnowballStemmer, WordNetLemmatizer
 from tqdm import tqdm
 
-nlp = spacy.load("en_core_web_sm", disable=["tagger", "ner", "lemmatizer"])
+from .cache import DocCache
+
+# dependencies that relatio should only import on first use
+HEAVY_MODULES = [
+    "allennlp",
+    "allennlp_models",
+    "gensim",
+    "matplotlib",
+    "networkx",
+    "nltk",
+    "pyvis",
+    "sklearn",
+    "spacy",
+    "tensorflow",
+    "tensorflow_hub",
+    "torch",
+]
+
+# components of the spaCy model not needed to split sentences
+_PARSER_DISABLE = ["tagger", "ner", "lemmatizer"]
+
+# components of the spaCy model not needed to split sentences and find named entities
+_ANNOTATE_DISABLE = ["tagger", "lemmatizer"]
+
+
+@lru_cache(maxsize=None)
+def _load_spacy_model(name: str, disable: Tuple[str, ...]):
+    import spacy
+
+    return spacy.load(name, disable=list(disable))
+
+
+def get_spacy_model(name: str = "en_core_web_sm", disable: Iterable[str] = ()):
+
+    """
+
+    Load a spaCy pipeline on first use, and share it within the process with all users of the same configuration.
+
+    Args:
+        name: name or path of the spaCy model
+        disable: components of the pipeline to disable
+
+    Returns:
+        The spaCy pipeline
+
+    """
+
+    return _load_spacy_model(name, tuple(sorted(disable)))
+
+
+def __getattr__(name: str):
+    # utils.nlp (the spaCy pipeline splitting sentences) and utils.wnl are loaded on first access
+    if name == "nlp":
+        return get_spacy_model("en_core_web_sm", disable=_PARSER_DISABLE)
+    if name == "wnl":
+        return _wordnet_lemmatizer()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def benchmark_import(module: str = "relatio.wrappers") -> Dict[str, Any]:
+
+    """
+
+    Time the import of a module in a new Python process, and list the heavy dependencies imported with it.
+
+    Args:
+        module: name of the module
+
+    Returns:
+        A dictionary with the seconds taken by the import and the HEAVY_MODULES it imported
+
+    Example:
+        >>> benchmark_import("relatio.wrappers")["heavy_modules"]
+        []
+
+    """
+
+    code = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "seconds = time.perf_counter() - start\n"
+        f"heavy_modules = [m for m in {HEAVY_MODULES!r} if m in sys.modules]\n"
+        "print(json.dumps({'seconds': seconds, 'heavy_modules': heavy_modules}))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout
+
+    return json.loads(output.splitlines()[-1])
+
+
+SEGMENTERS = ["parser", "sentencizer", "regex"]
+
+# end of a sentence: punctuation, possibly followed by closing quotes or brackets, then a space
+_SENTENCE_END = re.compile(r"[.!?]+[\"')\]]*(?=\s|$)")
+
+
+@lru_cache(maxsize=None)
+def _sentencizer():
+    # spaCy rule-based sentence splitter, without the parser
+    import spacy
+
+    sentencizer = spacy.blank("en")
+    sentencizer.add_pipe("sentencizer")
+    return sentencizer
+
+
+def _regex_sentence_spans(text: str) -> List[Tuple[int, int]]:
+
+    """
+
+    Character spans of the sentences of a text, split after sentence-ending punctuation followed by a space.
+
+    Example:
+        >>> text = 'Hi there! "I run." Ok'
+        >>> [text[start:end] for start, end in _regex_sentence_spans(text)]
+        ['Hi there!', '"I run."', 'Ok']
+
+    """
+
+    spans = []
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        spans.append((start, match.end()))
+        start = match.end()
+    spans.append((start, len(text)))
+
+    # spaces between sentences are left out
+    stripped = []
+    for start, end in spans:
+        sent = text[start:end]
+        if sent.strip():
+            stripped.append(
+                (start + len(sent) - len(sent.lstrip()), start + len(sent.rstrip()))
+            )
+
+    return stripped
+
+
+def _segmenter_pipeline(segmenter: str):
+    # the spaCy pipeline of a segmenter (None for the regex segmenter)
+    if segmenter == "parser":
+        return get_spacy_model("en_core_web_sm", disable=_PARSER_DISABLE)
+    if segmenter == "sentencizer":
+        return _sentencizer()
+    return None
+
+
+def _iter_sentence_spans(
+    texts: Iterable[Tuple[str, Any]],
+    segmenter: str = "parser",
+    batch_size: int = 1000,
+    n_process: int = 1,
+) -> Iterator[Tuple[str, List[Tuple[int, int]], Any]]:
+    # texts with their context, the character spans of their sentences and their context
+    if segmenter not in SEGMENTERS:
+        raise ValueError(f"segmenter should be one of {SEGMENTERS}.")
+
+    if segmenter == "regex":
+        for text, context in texts:
+            yield text, _regex_sentence_spans(text), context
+        return
+
+    pipeline = _segmenter_pipeline(segmenter)
+    for parsed, context in pipeline.pipe(
+        texts, as_tuples=True, batch_size=batch_size, n_process=n_process
+    ):
+        spans = [(sent.start_char, sent.end_char) for sent in parsed.sents]
+        yield parsed.text, spans, context
+
+
+def iter_sentences(
+    docs: Iterable[Dict[str, str]],
+    segmenter: str = "parser",
+    batch_size: int = 1000,
+    n_process: int = 1,
+) -> Iterator[Tuple[str, str]]:
+
+    """
+
+    A generator that splits a stream of documents into sentences.
+
+    Args:
+        docs: an iterable of dictionaries with keys "id" and "doc" (e.g. read lazily from disk)
+        segmenter: "parser" (the SpaCy dependency parser), "sentencizer" (the rule-based SpaCy sentencizer)
+        or "regex" (a split after sentence-ending punctuation), from the most accurate to the fastest (see benchmark_segmenters)
+        batch_size: number of documents processed together by SpaCy
+        n_process: number of processes running SpaCy (default is 1, i.e. this process only)
+
+    Returns:
+        An iterator over tuples of document index and sentence, in the order of the documents
+
+    """
+
+    texts = ((doc["doc"], doc["id"]) for doc in docs)
+
+    for text, spans, doc_id in _iter_sentence_spans(
+        texts, segmenter=segmenter, batch_size=batch_size, n_process=n_process
+    ):
+        for start, end in spans:
+            yield doc_id, text[start:end]
+
+
+def boundary_agreement(
+    spans: List[List[Tuple[int, int]]], reference: List[List[Tuple[int, int]]]
+) -> Dict[str, float]:
+
+    """
+
+    Agreement of sentence boundaries with reference boundaries in the same documents.
+
+    A boundary is the start of a sentence other than the first of its document.
+
+    Args:
+        spans: character spans of the sentences of each document
+        reference: reference character spans of the sentences of each document
+
+    Returns:
+        A dictionary with the precision, recall and F1 score of the boundaries
+
+    Example:
+        >>> reference = [[(0, 9), (10, 16)], [(0, 4)]]
+        >>> spans = [[(0, 3), (4, 9), (10, 16)], [(0, 4)]]
+        >>> boundary_agreement(spans, reference)
+        {'precision': 0.5, 'recall': 1.0, 'f1': 0.6666666666666666}
+
+    """
+
+    n_found = n_reference = n_common = 0
+    for doc_spans, doc_reference in zip(spans, reference):
+        found = {start for start, _ in doc_spans[1:]}
+        expected = {start for start, _ in doc_reference[1:]}
+        n_found += len(found)
+        n_reference += len(expected)
+        n_common += len(found & expected)
+
+    precision = n_common / n_found if n_found else 1.0
+    recall = n_common / n_reference if n_reference else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+
+    return {"precision": precision, "recall": recall, "f1": f1}
+
+
+def benchmark_segmenters(
+    docs: List[str],
+    segmenters: List[str] = SEGMENTERS,
+    batch_size: int = 1000,
+    n_process: int = 1,
+) -> Dict[str, Dict[str, float]]:
+
+    """
+
+    Compare the speed of the sentence segmenters and the agreement of their boundaries with the parser.
+
+    Args:
+        docs: a held-out sample of documents
+        segmenters: segmenters to compare (see iter_sentences)
+        batch_size: number of documents processed together by SpaCy
+        n_process: number of processes running SpaCy
+
+    Returns:
+        A dictionary with, for each segmenter, the seconds taken, the number of documents per second,
+        and the precision, recall and F1 score of its boundaries against the parser (see boundary_agreement)
+
+    """
+
+    spans = {}
+    results = {}
+    for segmenter in ["parser"] + [s for s in segmenters if s != "parser"]:
+        # pipelines are loaded before timing, so that only segmentation is timed
+        if segmenter not in SEGMENTERS:
+            raise ValueError(f"segmenter should be one of {SEGMENTERS}.")
+        _segmenter_pipeline(segmenter)
+
+        start = time.perf_counter()
+        spans[segmenter] = [
+            doc_spans
+            for _, doc_spans, _ in _iter_sentence_spans(
+                ((doc, None) for doc in docs),
+                segmenter=segmenter,
+                batch_size=batch_size,
+                n_process=n_process,
+            )
+        ]
+        seconds = time.perf_counter() - start
+        results[segmenter] = {
+            "seconds": seconds,
+            "docs_per_second": len(docs) / seconds if seconds else float("inf"),
+            **boundary_agreement(spans[segmenter], spans["parser"]),
+        }
+
+    return {segmenter: results[segmenter] for segmenter in segmenters}
+
+
+def annotate_documents(
+    docs: Iterable[Dict[str, str]],
+    doc_cache_path: str,
+    batch_size: int = 1000,
+    n_process: int = 1,
+    shard_size: int = 10000,
+) -> DocCache:
+
+    """
+
+    Run SpaCy once over documents, finding both sentence boundaries and named entities, and store them on disk.
+
+    split_into_sentences and named_entity_recognition.mine_entities read the cache instead of running SpaCy again.
+
+    Args:
+        docs: an iterable of dictionaries with keys "id" and "doc"
+        doc_cache_path: directory of the cache (see cache.DocCache)
+        batch_size: number of documents processed together by SpaCy
+        n_process: number of processes running SpaCy (default is 1, i.e. this process only)
+        shard_size: number of documents per file of the cache
+
+    Returns:
+        The cache of the documents
+
+    """
+
+    pipeline = get_spacy_model("en_core_web_sm", disable=_ANNOTATE_DISABLE)
+    texts = ((doc["doc"], doc["id"]) for doc in docs)
+
+    def parsed_docs():
+        for parsed, doc_id in pipeline.pipe(
+            texts, as_tuples=True, batch_size=batch_size, n_process=n_process
+        ):
+            parsed.user_data["id"] = doc_id
+            yield parsed
+
+    cache = DocCache(doc_cache_path, shard_size=shard_size)
+    cache.write(parsed_docs())
+
+    return cache
 
 
 def split_into_sentences(
-    dataframe: pd.DataFrame,
+    dataframe: Optional[Union[pd.DataFrame, Iterable[Dict[str, str]]]],
     output_path: Optional[str] = None,
+    segmenter: str = "parser",
+    batch_size: int = 1000,
+    n_process: int = 1,
     progress_bar: bool = False,
+    doc_cache_path: Optional[str] = None,
 ) -> Tuple[List[str], List[str]]:
 
     """
 
-    A function that splits a list of documents into sentences (using the SpaCy sentence splitter).
+    A function that splits a list of documents into sentences (using the SpaCy sentence splitter by default).
 
     Args:
         dataframe: a pandas dataframe with one column "id" and one column "doc"
+        (or any iterable of dictionaries with keys "id" and "doc", see iter_sentences)
         output_path: path to save the output
+        segmenter: "parser", "sentencizer" or "regex" (see iter_sentences and benchmark_segmenters)
+        batch_size: number of documents processed together by SpaCy
+        n_process: number of processes running SpaCy (default is 1, i.e. this process only)
         progress_bar: print a progress bar (default is False)
+        doc_cache_path: directory of a cache of the SpaCy documents, with their sentences and named entities
+        (see annotate_documents). It is built from the documents if it does not exist, and read otherwise, in which case
+        dataframe may be None, and a ValueError is raised if it holds other documents. Only the "parser" segmenter is supported (default is None, i.e. no cache).
 
     Returns:
         Tuple with the list of document indices and list of sentences
 
     """
 
-    docs = dataframe.to_dict(orient="records")
+    if doc_cache_path is not None and segmenter != "parser":
+        raise ValueError("doc_cache_path is only supported by the parser segmenter.")
+
+    if isinstance(dataframe, pd.DataFrame):
+        docs = (
+            {"id": doc_id, "doc": doc}
+            for doc_id, doc in zip(dataframe["id"], dataframe["doc"])
+        )
+        total = len(dataframe)
+    else:
+        docs = dataframe
+        total = None
 
     sentences: List[str] = []
     doc_indices: List[str] = []
 
-    if progress_bar:
-        print("Splitting into sentences...")
-        time.sleep(1)
-        docs = tqdm(docs)
+    if doc_cache_path is not None:
+        cache = DocCache(doc_cache_path)
 
-    for doc in docs:
-        for sent in nlp(doc["doc"], disable=["tagger", "ner"]).sents:
-            sentences.append(str(sent))
-            doc_indices = doc_indices + [doc["id"]]
+        if not cache.exists():
+            if progress_bar:
+                print("Parsing documents...")
+                time.sleep(1)
+                docs = tqdm(docs, total=total)
+            annotate_documents(
+                docs, doc_cache_path, batch_size=batch_size, n_process=n_process
+            )
+        elif docs is not None:
+            cache.check_documents(docs)
+
+        cached_docs: Iterable[Any] = cache
+        if progress_bar:
+            print("Splitting into sentences...")
+            time.sleep(1)
+            cached_docs = tqdm(cache, total=len(cache))
+
+        for doc in cached_docs:
+            for sent in doc.sents:
+                sentences.append(sent.text)
+                doc_indices.append(doc.user_data["id"])
+
+    else:
+        if progress_bar:
+            print("Splitting into sentences...")
+            time.sleep(1)
+            docs = tqdm(docs, total=total)
+
+        for doc_id, sent in iter_sentences(
+            docs, segmenter=segmenter, batch_size=batch_size, n_process=n_process
+        ):
+            sentences.append(sent)
+            doc_indices.append(doc_id)
 
     if output_path is not None:
         with open(output_path, "w") as f:
@@ -131,18 +526,25 @@ def group_sentences_in_batches(
     sentences: List[str],
     max_batch_char_length: Optional[int] = None,
     batch_size: Optional[int] = None,
+    max_batch_tokens: Optional[int] = None,
+    count_tokens: Optional[Callable[[str], int]] = None,
 ) -> List[List[str]]:
 
     """
 
-    Group sentences in batches of given total character length or size (number of sentences).
+    Group sentences in batches of given total character length, size (number of sentences) or padded number of tokens.
 
-    In case a sentence is longer than max_batch_char_length it is replaced with an empty string.
+    The padded number of tokens of a batch is its number of sentences times the number of tokens of its longest sentence,
+    i.e. the size of the padded tensor built by the model.
+
+    In case a sentence is longer than max_batch_char_length (or has more tokens than max_batch_tokens) it is replaced with an empty string.
 
     Args:
         sentences: List of sentences
         max_batch_char_length: maximum char length for a batch
         batch_size: number of sentences
+        max_batch_tokens: maximum padded number of tokens for a batch
+        count_tokens: function returning the number of tokens of a sentence (default is the number of words)
 
     Returns:
         List of batches (list) of sentences.
@@ -166,13 +568,24 @@ def group_sentences_in_batches(
         [['This is a house', 'This is a house'], ['This is a house']]
         >>> group_sentences_in_batches(['This is a house','This is a house','This is a house'], batch_size=2)
         [['This is a house', 'This is a house'], ['This is a house']]
+        >>> group_sentences_in_batches(['This is a house','Hi','This is a house'], max_batch_tokens=8)
+        [['This is a house', 'Hi'], ['This is a house']]
+        >>> group_sentences_in_batches(['Hi','Hi','This is a house'], max_batch_tokens=8)
+        [['Hi', 'Hi'], ['This is a house']]
+        >>> group_sentences_in_batches(['This is a house','Hi','This is a house'], max_batch_tokens=3)
+        [['', 'Hi', '']]
+        >>> group_sentences_in_batches(['This is a house','Hi'], max_batch_tokens=16, count_tokens=len)
+        [['This is a house'], ['Hi']]
 
     """
 
     batches: List[List[str]] = []
 
-    if max_batch_char_length is not None and batch_size is not None:
-        raise ValueError("max_batch_char_length and batch_size are mutually exclusive.")
+    budgets = [max_batch_char_length, batch_size, max_batch_tokens]
+    if sum(budget is not None for budget in budgets) > 1:
+        raise ValueError(
+            "max_batch_char_length, batch_size and max_batch_tokens are mutually exclusive."
+        )
     elif max_batch_char_length is not None:
 
         # longer sentences are replaced with an empty string
@@ -199,21 +612,407 @@ def group_sentences_in_batches(
         batches = [
             sentences[i : i + batch_size] for i in range(0, len(sentences), batch_size)
         ]
+    elif max_batch_tokens is not None:
+
+        if count_tokens is None:
+            count_tokens = lambda sent: len(sent.split())
+
+        batch_tokens = 0  # number of tokens of the longest sentence in the batch
+        batch = []
+
+        for el in sentences:
+            n_tokens = count_tokens(el)
+            # longer sentences are replaced with an empty string
+            if n_tokens > max_batch_tokens:
+                el = ""
+                n_tokens = count_tokens(el)
+            longest = max(batch_tokens, n_tokens)
+            if batch and (len(batch) + 1) * longest > max_batch_tokens:
+                batches.append(batch)
+                batch = [el]
+                batch_tokens = n_tokens
+            else:
+                batch.append(el)
+                batch_tokens = longest
+
+        if batch:
+            batches.append(batch)
+
     else:
         batches = [sentences]
 
     return batches
 
 
+def sort_sentences_by_length(
+    sentences: List[str], window: Optional[int] = None
+) -> List[int]:
+
+    """
+
+    Get the positions that sort sentences by number of words, within consecutive windows of sentences.
+
+    Sorting keeps sentences of similar length together, so that batches built on the sorted list need little padding.
+    The sort is stable: sentences of equal length keep their relative order.
+
+    Args:
+        sentences: list of sentences
+        window: number of consecutive sentences sorted together (default is None, i.e. the whole list)
+
+    Returns:
+        List of positions in the original list, in sorted order.
+
+    Examples:
+        >>> sort_sentences_by_length(['This is a house', 'Hi', 'It is a nice house', 'Hello you'])
+        [1, 3, 0, 2]
+        >>> sort_sentences_by_length(['This is a house', 'Hi', 'It is a nice house', 'Hello you'], window=2)
+        [1, 0, 3, 2]
+        >>> sort_sentences_by_length([])
+        []
+
+    """
+
+    if window is not None and window < 1:
+        raise ValueError("window should be a positive integer.")
+
+    if window is None:
+        window = max(len(sentences), 1)
+
+    order: List[int] = []
+    for start in range(0, len(sentences), window):
+        positions = range(start, min(start + window, len(sentences)))
+        order.extend(sorted(positions, key=lambda i: len(sentences[i].split())))
+
+    return order
+
+
+def restore_order(items: list, order: List[int]) -> list:
+
+    """
+
+    Put back in their original positions items listed in the order given by sort_sentences_by_length.
+
+    Args:
+        items: list of items in sorted order
+        order: positions in the original list (see sort_sentences_by_length)
+
+    Returns:
+        List of items in the original order.
+
+    Examples:
+        >>> restore_order(['Hi', 'Hello you', 'This is a house', 'It is a nice house'], [1, 3, 0, 2])
+        ['This is a house', 'Hi', 'It is a nice house', 'Hello you']
+
+    """
+
+    if len(items) != len(order):
+        raise ValueError("items and order should have the same length.")
+
+    res = [None] * len(items)
+    for item, i in zip(items, order):
+        res[i] = item
+
+    return res
+
+
+class WordCache:
+
+    """
+
+    A bounded memo of word-level results (e.g. POS tags or lemmas), which evicts the least recently used entries.
+
+    Args:
+        maxsize: maximum number of entries (default is 2**20, None means unbounded)
+
+    Example:
+        >>> cache = WordCache(maxsize=2)
+        >>> [cache.get(word, str.upper) for word in ['a', 'b', 'a', 'c', 'b']]
+        ['A', 'B', 'A', 'C', 'B']
+        >>> cache.stats()
+        {'hits': 1, 'misses': 4, 'hit_rate': 0.2, 'size': 2, 'maxsize': 2}
+
+    """
+
+    def __init__(self, maxsize: Optional[int] = 2**20):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, key: Hashable, compute: Callable[[Any], Any]) -> Any:
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            value = self._entries[key] = compute(key)
+            if self.maxsize is not None and len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+        return value
+
+    def resize(self, maxsize: Optional[int]):
+        self.maxsize = maxsize
+        while maxsize is not None and len(self._entries) > maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        n_calls = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / n_calls if n_calls else 0.0,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
+
+    def items(self) -> List[Tuple[Any, Any]]:
+        return list(self._entries.items())
+
+    def update(self, items: Iterable[Tuple[Any, Any]]):
+        for key, value in items:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+        self.resize(self.maxsize)
+
+
+# memos of _get_wordnet_pos (word -> tag) and _lemmatize ((word, pos) -> lemma)
+pos_cache = WordCache()
+lemma_cache = WordCache()
+
+
+def save_word_caches(path: str):
+
+    """
+
+    Save the POS and lemma memos (pos_cache and lemma_cache) to a JSON file, to preload them in a later run.
+
+    """
+
+    with open(path, "w") as f:
+        json.dump({"pos": pos_cache.items(), "lemma": lemma_cache.items()}, f)
+
+
+def load_word_caches(path: str):
+
+    """
+
+    Preload the POS and lemma memos (pos_cache and lemma_cache) from a file written by save_word_caches.
+
+    """
+
+    with open(path, "r") as f:
+        caches = json.load(f)
+
+    pos_cache.update(caches["pos"])
+    lemma_cache.update((tuple(key), lemma) for key, lemma in caches["lemma"])
+
+
+def _tag_word(word):
+    from nltk import pos_tag
+
+    return pos_tag([word])[0][1][0].upper()
+
+
 def _get_wordnet_pos(word):
     """Get POS tag"""
-    tag = pos_tag([word])[0][1][0].upper()
+    tag = pos_cache.get(word, _tag_word)
 
     return tag
 
 
-wnl = WordNetLemmatizer()
-f_lemmatize = wnl.lemmatize
+@lru_cache(maxsize=None)
+def _wordnet_lemmatizer():
+    from nltk.stem import WordNetLemmatizer
+
+    return WordNetLemmatizer()
+
+
+def f_lemmatize(word: str, pos: str = "n") -> str:
+    return _wordnet_lemmatizer().lemmatize(word, pos)
+
+
+def _lemmatize(word, pos):
+    return lemma_cache.get((word, pos), lambda key: f_lemmatize(*key))
+
+
+# characters with a special meaning in a regular expression character set
+_CHARSET_SPECIALS = frozenset("\\-^[]")
+
+
+class TextCleaner:
+
+    """
+
+    A text cleaning pipeline, configured once and applied to many batches of sentences.
+
+    The characters to remove are compiled into a translation table, stop words are kept in a set and
+    the stemmer is created once. Calling it on a list of sentences gives the same result as clean_text.
+
+    Args:
+        See clean_text.
+
+    Example:
+        >>> cleaner = TextCleaner(stop_words=['factorial'])
+        >>> cleaner([' Return the factorial of n, an  exact integer >= 0.', 'Learning is usefull.'])
+        ['return the of n an exact integer', 'learning is usefull']
+
+    """
+
+    def __init__(
+        self,
+        remove_punctuation: bool = True,
+        remove_digits: bool = True,
+        remove_chars: str = "",
+        stop_words: Optional[List[str]] = None,
+        lowercase: bool = True,
+        strip: bool = True,
+        remove_whitespaces: bool = True,
+        lemmatize: bool = False,
+        stem: bool = False,
+        tags_to_keep: Optional[List[str]] = None,
+        remove_n_letter_words: Optional[int] = None,
+        tag_sentences: bool = False,
+    ):
+        if lemmatize is True and stem is True:
+            raise ValueError("lemmatize and stemming cannot be both True")
+        if stop_words is not None and lowercase is False:
+            raise ValueError("remove stop words make sense only for lowercase")
+
+        # remove chars
+        if remove_punctuation:
+            remove_chars += string.punctuation
+        if remove_digits:
+            remove_chars += string.digits
+
+        self._table: Optional[Dict[int, None]] = None
+        self._pattern: Optional[re.Pattern] = None
+        if remove_chars:
+            pattern = re.compile(f"[{remove_chars}]")
+            if _CHARSET_SPECIALS.intersection(
+                remove_chars.replace(string.punctuation, "")
+            ):
+                # remove_chars holds a range or a negation
+                self._pattern = pattern
+            else:
+                # the characters matched by the set (e.g. the backslash of "\\]" is not)
+                self._table = str.maketrans(
+                    "", "", "".join(filter(pattern.match, remove_chars))
+                )
+
+        self._lowercase = lowercase
+        self._strip = strip
+        self._remove_whitespaces = remove_whitespaces
+        self._lemmatize = lemmatize
+        if lemmatize:
+            from nltk.corpus import wordnet
+
+            self._default_pos = wordnet.NOUN
+            self._tag_dict = {
+                "J": wordnet.ADJ,
+                "N": wordnet.NOUN,
+                "V": wordnet.VERB,
+                "R": wordnet.ADV,
+            }
+        self._stem = None
+        if stem:
+            from nltk.stem import SnowballStemmer
+
+            self._stem = SnowballStemmer("english").stem
+        self._tags_to_keep = (
+            frozenset(tags_to_keep) if tags_to_keep is not None else None
+        )
+        self._stop_words = frozenset(stop_words) if stop_words is not None else None
+        self._remove_n_letter_words = remove_n_letter_words
+        self._tag_sentences = tag_sentences
+
+        # whether words are processed one by one after the string operations
+        self._word_steps = (
+            lemmatize
+            or stem
+            or tags_to_keep is not None
+            or stop_words is not None
+            or remove_n_letter_words is not None
+        )
+
+    def __call__(self, sentences: List[str]) -> List[str]:
+        sentences = [self._clean_string(sent) for sent in sentences]
+
+        if not self._word_steps:
+            return sentences
+
+        words = [sent.split() for sent in sentences]
+
+        # all sentences are tagged at once, and their tags are used by all steps
+        if self._tag_sentences and (self._lemmatize or self._tags_to_keep is not None):
+            from nltk import pos_tag_sents
+
+            tags = [
+                [tag[0].upper() for _, tag in tagged] for tagged in pos_tag_sents(words)
+            ]
+        else:
+            tags = [None] * len(words)
+
+        return [
+            self._clean_words(sent_words, sent_tags)
+            for sent_words, sent_tags in zip(words, tags)
+        ]
+
+    def _clean_string(self, sent: str) -> str:
+        if self._table is not None:
+            sent = str(sent).translate(self._table)
+        elif self._pattern is not None:
+            sent = self._pattern.sub("", str(sent))
+
+        # lowercase, strip and remove superfluous white spaces
+        if self._lowercase:
+            sent = sent.lower()
+        if self._strip:
+            sent = sent.strip()
+        if self._remove_whitespaces:
+            sent = " ".join(sent.split())
+
+        return sent
+
+    def _clean_words(self, words: List[str], tags: Optional[List[str]]) -> str:
+        # without sentence tags, each word is tagged on its own
+
+        # lemmatize
+        if self._lemmatize:
+            word_tags = tags if tags is not None else map(_get_wordnet_pos, words)
+            words = [
+                _lemmatize(word, self._tag_dict.get(tag, self._default_pos))
+                for word, tag in zip(words, word_tags)
+            ]
+
+        # keep specific nltk tags
+        # this step should be performed before stemming, but may be performed after lemmatization
+        if self._tags_to_keep is not None:
+            word_tags = tags if tags is not None else map(_get_wordnet_pos, words)
+            words = [
+                word for word, tag in zip(words, word_tags) if tag in self._tags_to_keep
+            ]
+
+        # stem
+        if self._stem is not None:
+            words = [self._stem(word) for word in words]
+
+        # drop stopwords
+        # stopwords are dropped after the bulk of preprocessing steps, so they should also be preprocessed with the same standards
+        if self._stop_words is not None:
+            words = [word for word in words if word not in self._stop_words]
+
+        # remove short words < n
+        if self._remove_n_letter_words is not None:
+            words = [word for word in words if len(word) > self._remove_n_letter_words]
+
+        return " ".join(words)
 
 
 def clean_text(
@@ -229,6 +1028,8 @@ def clean_text(
     stem: bool = False,
     tags_to_keep: Optional[List[str]] = None,
     remove_n_letter_words: Optional[int] = None,
+    tag_sentences: bool = False,
+    n_jobs: Optional[int] = None,
 ) -> List[str]:
 
     """
@@ -244,10 +1045,13 @@ def clean_text(
         lowercase: whether to lower the case
         strip: whether to strip
         remove_whitespaces: whether to remove superfluous whitespaceing by " ".join(str.split(())
-        lemmatize: whether to lemmatize using nltk.WordNetLemmatizer
+        lemmatize: whether to lemmatize using nltk.WordNetLemmatizer (tags and lemmas of words are memoized in pos_cache and lemma_cache)
         stem: whether to stem using nltk.SnowballStemmer("english")
         tags_to_keep: list of grammatical tags to keep (common tags: ['V', 'N', 'J'])
         remove_n_letter_words: drop words lesser or equal to n letters (default is None)
+        tag_sentences: for lemmatize and tags_to_keep, tag the words of all sentences at once and in their context
+        with nltk.pos_tag_sents, instead of each word on its own (tags_to_keep then uses the tags of the words before lemmatization)
+        n_jobs: number of processes cleaning chunks of sentences (-1 for all CPUs, default is None, i.e. this process only)
 
     Returns:
         Processed list of sentences
@@ -273,93 +1077,75 @@ def clean_text(
         ['is nice']
         >>> clean_text(['This is a sentence with one and two letter words.'], remove_n_letter_words = 2)
         ['this sentence with one and two letter words']
+        >>> clean_text(['This is a sentence with verbs and nice adjectives.'], tags_to_keep = ['V', 'J'], tag_sentences=True)
+        ['is nice']
 
     """
 
-    if lemmatize is True and stem is True:
-        raise ValueError("lemmatize and stemming cannot be both True")
-    if stop_words is not None and lowercase is False:
-        raise ValueError("remove stop words make sense only for lowercase")
-
-    # remove chars
-    if remove_punctuation:
-        remove_chars += string.punctuation
-    if remove_digits:
-        remove_chars += string.digits
-    if remove_chars:
-        sentences = [re.sub(f"[{remove_chars}]", "", str(sent)) for sent in sentences]
-
-    # lowercase, strip and remove superfluous white spaces
-    if lowercase:
-        sentences = [sent.lower() for sent in sentences]
-    if strip:
-        sentences = [sent.strip() for sent in sentences]
-    if remove_whitespaces:
-        sentences = [" ".join(sent.split()) for sent in sentences]
-
-    # lemmatize
-    if lemmatize:
-
-        tag_dict = {
-            "J": wordnet.ADJ,
-            "N": wordnet.NOUN,
-            "V": wordnet.VERB,
-            "R": wordnet.ADV,
-        }
+    cleaner = TextCleaner(
+        remove_punctuation=remove_punctuation,
+        remove_digits=remove_digits,
+        remove_chars=remove_chars,
+        stop_words=stop_words,
+        lowercase=lowercase,
+        strip=strip,
+        remove_whitespaces=remove_whitespaces,
+        lemmatize=lemmatize,
+        stem=stem,
+        tags_to_keep=tags_to_keep,
+        remove_n_letter_words=remove_n_letter_words,
+        tag_sentences=tag_sentences,
+    )
+
+    return map_in_chunks(cleaner, sentences, n_jobs=n_jobs)
+
+
+def map_in_chunks(
+    func: Callable[[list], list],
+    items: Iterable,
+    n_jobs: Optional[int] = None,
+    chunk_size: int = 1000,
+    progress_bar: bool = False,
+) -> list:
 
-        sentences = [
-            " ".join(
-                [
-                    f_lemmatize(
-                        word, tag_dict.get(_get_wordnet_pos(word), wordnet.NOUN)
-                    )
-                    for word in sent.split()
-                ]
-            )
-            for sent in sentences
-        ]
+    """
 
-    # keep specific nltk tags
-    # this step should be performed before stemming, but may be performed after lemmatization
-    if tags_to_keep is not None:
-        sentences = [
-            " ".join(
-                [
-                    word
-                    for word in sent.split()
-                    if _get_wordnet_pos(word) in tags_to_keep
-                ]
-            )
-            for sent in sentences
-        ]
+    Apply a function of a list of items to consecutive chunks of items in a pool of processes,
+    and concatenate the results in the order of the chunks.
 
-    # stem
-    if stem:
-        stemmer = SnowballStemmer("english")
-        f_stem = stemmer.stem
+    Inputs that fit in a single chunk are processed in this process, without the overhead of a pool.
 
-        sentences = [
-            " ".join([f_stem(word) for word in sent.split()]) for sent in sentences
-        ]
+    Args:
+        func: function taking a list of items and returning a list (picklable, e.g. defined at the top of a module)
+        items: items to process
+        n_jobs: number of processes (-1 for all CPUs, default is None, i.e. this process only)
+        chunk_size: number of items sent to a process at once
+        progress_bar: print a progress bar over the chunks (default is False)
 
-    # drop stopwords
-    # stopwords are dropped after the bulk of preprocessing steps, so they should also be preprocessed with the same standards
-    if stop_words is not None:
-        sentences = [
-            " ".join([word for word in sent.split() if word not in stop_words])
-            for sent in sentences
-        ]
+    Returns:
+        The concatenated results
 
-    # remove short words < n
-    if remove_n_letter_words is not None:
-        sentences = [
-            " ".join(
-                [word for word in sent.split() if len(word) > remove_n_letter_words]
-            )
-            for sent in sentences
-        ]
+    Example:
+        >>> map_in_chunks(sorted, [3, 1, 2, 5, 4], n_jobs=2, chunk_size=2)
+        [1, 3, 2, 5, 4]
 
-    return sentences
+    """
+
+    items = list(items)
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+
+    if n_jobs is None or n_jobs <= 1 or len(items) <= chunk_size:
+        return func(items)
+
+    chunks = [items[i : i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+    with multiprocessing.Pool(min(n_jobs, len(chunks))) as pool:
+        results = pool.imap(func, chunks)
+        if progress_bar:
+            results = tqdm(results, total=len(chunks))
+        return [res for chunk_res in results for res in chunk_res]
 
 
 def is_subsequence(v1: list, v2: list) -> bool:
@@ -14,7 +14,6 @@ from collections import Counter
 from copy import deepcopy
 from typing import List, Optional
 
-from nltk.corpus import wordnet
 from tqdm import tqdm
 
 
@@ -38,6 +37,8 @@ def find_synonyms(verb: str) -> List[str]:
 
     synonyms = []
 
+    from nltk.corpus import wordnet
+
     for syn in wordnet.synsets(verb, pos=wordnet.VERB):
         for lemma in syn.lemmas():
             synonyms.append(lemma.name())
@@ -65,6 +66,8 @@ def find_antonyms(verb: str) -> List[str]:
 
     antonyms = []
 
+    from nltk.corpus import wordnet
+
     for syn in wordnet.synsets(verb, pos=wordnet.VERB):
         for lemma in syn.lemmas():
             if lemma.antonyms():
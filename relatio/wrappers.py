@@ -12,10 +12,13 @@
 import json
 import os
 import pickle as pk
-from typing import List, Optional
+import time
+from itertools import islice
+from typing import Iterable, List, Optional, Union
 
 import numpy as np
 import pandas as pd
+from tqdm import tqdm
 
 from .clustering import (
     USE,
@@ -29,19 +32,43 @@ from .clustering import (
 )
 from .named_entity_recognition import map_entities, mine_entities
 from .semantic_role_labeling import SRL, extract_roles, process_roles, rename_arguments
+from .server import SRLClient
+from .storage import CompactSRL, iter_srl_shards, load_manifest, write_srl_shard
 from .utils import clean_text, count_values, is_subsequence
 from .verbs import clean_verbs
 
 
+def _save_profile(profile: List[dict], profile_path: Optional[str]):
+    if profile_path is None:
+        return
+    if profile_path.endswith(".json"):
+        with open(profile_path, "w") as f:
+            json.dump(profile, f)
+    else:
+        pd.DataFrame(profile).to_csv(profile_path, index=False)
+
+
 def run_srl(
     path: str,
-    sentences: List[str],
+    sentences: Iterable[str],
     batch_size: Optional[int] = None,
-    max_batch_char_length: Optional[int] = 20_000,
+    max_batch_char_length: Optional[int] = None,
     cuda_device: int = -1,
     max_sentence_length: Optional[int] = None,
     max_number_words: Optional[int] = None,
+    max_batch_tokens: Optional[int] = None,
     output_path: Optional[str] = None,
+    sort_by_length: bool = False,
+    sort_window: Optional[int] = None,
+    cache_path: Optional[str] = None,
+    shard_size: Optional[int] = None,
+    num_workers: Optional[int] = None,
+    bisect_on_error: bool = False,
+    pipeline: bool = False,
+    profile_path: Optional[str] = None,
+    quantize: Optional[str] = None,
+    server_url: Optional[str] = None,
+    skip_verbless: bool = False,
     progress_bar: bool = False,
 ):
 
@@ -50,31 +77,114 @@ def run_srl(
     A wrapper function to run semantic role labeling on a corpus.
 
     Args:
-        path: location of the SRL model to be used
-        sentences: list of sentences
+        path: location of the SRL model to be used (an archive or a snapshot, see semantic_role_labeling.save_predictor_snapshot).
+        The model is loaded once per process and reused by later calls.
+        sentences: list of sentences (any iterable of sentences with shard_size)
         batch_size: number of sentences in a batch
-        max_batch_char_length: maximum number of characters in a batch (incompatible with batch_size)
+        max_batch_char_length: maximum number of characters in a batch (incompatible with batch_size and max_batch_tokens,
+        default is 20 000 if neither is given)
         cuda_device: GPU only, and it should be one of CUDA_VISIBLE_DEVICES
         max_sentence_length: drop sentences with the length above this threshold
         max_number_words: drop the sentences with the number of words above this threshold
+        max_batch_tokens: maximum number of sentences times the number of wordpieces of the longest sentence in a batch
+        (incompatible with batch_size and max_batch_char_length)
         output_path: path to save the narrative model (default is None, which means no saving to disk)
+        sort_by_length: batch sentences of similar number of words together to reduce padding (results keep the input order)
+        sort_window: number of consecutive sentences sorted together (default is None, i.e. the whole corpus)
+        cache_path: location of a SQLite cache of SRL results, so that sentences labeled in earlier runs are not labeled again (default is None, i.e. no cache)
+        shard_size: stream the sentences and append the output to JSONL shards of shard_size sentences in the directory output_path.
+        An interrupted run resumes after the last completed shard. (default is None, i.e. the whole output is kept in memory)
+        num_workers: CPU only, number of worker processes running SRL in parallel (default is None, i.e. a single process)
+        bisect_on_error: retry a batch that raised a RuntimeError in halves and blank only the sentences that fail on their own
+        (default is False, i.e. the whole output is replaced with empty results)
+        pipeline: prepare and decode batches in background threads while the model runs (incompatible with num_workers)
+        profile_path: path to save statistics on each batch, as CSV (or JSON if the path ends with .json)
+        (default is None, which means no saving to disk)
+        quantize: CPU only, "dynamic" to run the model with int8 linear layers (see semantic_role_labeling.benchmark_quantization)
+        server_url: url of a running server.SRLServer to send the sentences to, in which case path is the name of the model on the server
+        and the options of the model (cuda_device, cache_path, num_workers, bisect_on_error, pipeline and quantize) and the batching options
+        (batch_size, max_batch_char_length, max_batch_tokens, sort_by_length and sort_window, which should not be set) are those of the server.
+        profile_path is not supported (default is None, i.e. the model is loaded in this process)
+        skip_verbless: give an empty result without running the model to sentences that surely have no verb (e.g. links, hashtags or numbers only).
+        The number of skipped sentences is printed with progress_bar.
         progress_bar: print a progress bar (default is False)
 
     Returns:
-        A list of dictionaries with the SRL output
+        A list of dictionaries with the SRL output (an iterator over the shards with shard_size)
 
     """
 
-    srl = SRL(path=path, cuda_device=cuda_device)
+    if shard_size is not None and output_path is None:
+        raise ValueError("shard_size requires output_path.")
 
-    srl_res = srl(
-        sentences=sentences,
-        batch_size=batch_size,
-        max_batch_char_length=max_batch_char_length,
-        max_sentence_length=max_sentence_length,
-        max_number_words=max_number_words,
-        progress_bar=progress_bar,
-    )
+    if server_url is not None and profile_path is not None:
+        raise ValueError("profile_path is not supported with server_url.")
+
+    # the batches of a server are those of its models
+    if (
+        server_url is None
+        and max_batch_char_length is None
+        and batch_size is None
+        and max_batch_tokens is None
+    ):
+        max_batch_char_length = 20_000
+
+    if server_url is not None:
+        srl = SRLClient(server_url, model=path)
+    else:
+        srl = SRL(
+            path=path,
+            cuda_device=cuda_device,
+            cache_path=cache_path,
+            num_workers=num_workers,
+            bisect_on_error=bisect_on_error,
+            pipeline=pipeline,
+            quantize=quantize,
+        )
+
+    srl_options = {
+        "batch_size": batch_size,
+        "max_batch_char_length": max_batch_char_length,
+        "max_sentence_length": max_sentence_length,
+        "max_number_words": max_number_words,
+        "max_batch_tokens": max_batch_tokens,
+        "sort_by_length": sort_by_length,
+        "sort_window": sort_window,
+        "skip_verbless": skip_verbless,
+    }
+
+    profile: List[dict] = []
+    if profile_path is not None:
+        # batches are numbered across calls of srl (e.g. one per shard)
+        srl_options["callback"] = lambda stats: profile.append(
+            {**stats, "batch": len(profile)}
+        )
+
+    # the worker processes of the model are stopped, and the profile saved, even if labeling fails
+    try:
+        if shard_size is not None:
+            # sentences of the completed shards are not labeled again
+            manifest = load_manifest(output_path)
+            sentences = islice(sentences, manifest["n_sentences"], None)
+
+            shards = srl.stream(sentences, chunk_size=shard_size, **srl_options)
+
+            if progress_bar:
+                print("Running SRL...")
+                time.sleep(1)
+                shards = tqdm(shards, unit="shard")
+
+            for srl_res in shards:
+                write_srl_shard(output_path, srl_res, manifest)
+
+        else:
+            srl_res = srl(sentences=sentences, progress_bar=progress_bar, **srl_options)
+    finally:
+        srl.close()
+        _save_profile(profile, profile_path)
+
+    if shard_size is not None:
+        return iter_srl_shards(output_path)
 
     if output_path is not None:
         with open(output_path, "w") as json_file:
@@ -84,7 +194,7 @@ def run_srl(
 
 
 def build_narrative_model(
-    srl_res: List[dict],
+    srl_res: Union[List[dict], CompactSRL],
     sentences: List[str],
     roles_considered: List[str] = [
         "ARG0",
@@ -107,6 +217,7 @@ def build_narrative_model(
     stem: bool = False,
     tags_to_keep: Optional[List[str]] = None,
     remove_n_letter_words: Optional[int] = None,
+    tag_sentences: bool = False,
     roles_with_embeddings: List[List[str]] = [["ARG0", "ARG1", "ARG2"]],
     embeddings_type: Optional[str] = None,
     embeddings_path: Optional[str] = None,
@@ -117,7 +228,9 @@ def build_narrative_model(
     ent_labels: List[str] = ["PERSON", "NORP", "ORG", "GPE", "EVENT"],
     top_n_entities: Optional[int] = None,
     dimension_reduce_verbs: Optional[bool] = True,
+    n_jobs: Optional[int] = None,
     progress_bar: bool = False,
+    doc_cache_path: Optional[str] = None,
 ):
 
     """
@@ -125,7 +238,7 @@ def build_narrative_model(
     A wrapper function to build the narrative model from a sample of the corpus.
 
     Args:
-        srl_res: sentences labeled with their semantic roles
+        srl_res: sentences labeled with their semantic roles (list of dictionaries or storage.CompactSRL)
         sentences: list of sentences
         roles_considered: list of semantic roles to consider
         output_path: path to save the narrative model (default is None, which means no saving to disk)
@@ -141,7 +254,12 @@ def build_narrative_model(
         ent_labels: list of entity labels to be considered (see SPaCy documentation)
         top_n_entities: number of named entities to keep (default is all and is specified with top_n = 0)
         dimension_reduce_verbs: if True, verbs are replaced by their most frequent synonyms/antonyms
+        n_jobs: number of processes cleaning roles and sentences and mining named entities
+        (-1 for all CPUs, default is None, i.e. this process only)
         progress_bar: print a progress bar (default is False)
+        doc_cache_path: directory of a cache of the SpaCy documents of the corpus, from which named entities are mined
+        (see utils.split_into_sentences, default is None, i.e. SpaCy is run on the sentences). The sentences should be
+        all the sentences of the cached documents, in order, or a ValueError is raised.
 
     Returns:
         A dictionary with the details of the pipeline to extract narratives from text
@@ -213,6 +331,7 @@ def build_narrative_model(
         "stem": stem,
         "tags_to_keep": tags_to_keep,
         "remove_n_letter_words": remove_n_letter_words,
+        "tag_sentences": tag_sentences,
     }
 
     # Process SRL
@@ -241,6 +360,8 @@ def build_narrative_model(
             tags_to_keep,
             remove_n_letter_words,
             progress_bar=progress_bar,
+            tag_sentences=tag_sentences,
+            n_jobs=n_jobs,
         )
 
     if output_path is not None:
@@ -288,6 +409,9 @@ def build_narrative_model(
                 tags_to_keep=tags_to_keep,
                 remove_n_letter_words=remove_n_letter_words,
                 progress_bar=progress_bar,
+                tag_sentences=tag_sentences,
+                n_process=n_jobs if n_jobs is not None else 1,
+                doc_cache_path=doc_cache_path,
             )
 
         if output_path is not None:
@@ -320,6 +444,8 @@ def build_narrative_model(
             stem,
             tags_to_keep,
             remove_n_letter_words,
+            tag_sentences,
+            n_jobs,
         )
 
         if progress_bar:
@@ -395,12 +521,13 @@ def build_narrative_model(
 
 
 def get_narratives(
-    srl_res: List[dict],
+    srl_res: Union[List[dict], CompactSRL],
     doc_index: List[int],
     narrative_model: dict,
     n_clusters: List[int],  # k means model you want to use
     output_path: Optional[str] = None,
     cluster_labeling: Optional[str] = "most_frequent",
+    n_jobs: Optional[int] = None,
     progress_bar: bool = False,
 ):
 
@@ -409,12 +536,13 @@ def get_narratives(
     A wrapper function to obtain the final mined narratives.
 
     Args:
-        srl_res: sentences labeled with their semantic roles
+        srl_res: sentences labeled with their semantic roles (list of dictionaries or storage.CompactSRL)
         doc_index: list of indices to keep track of original documents
         narrative_model: dict with the specifics of the narrative model
         n_clusters: clustering scenario to use for each group of semantic roles
         output_path: path to save the narrative model (default is None, which means no saving to disk)
         cluster_labeling: either 'most_frequent' or 'most_similar'
+        n_jobs: number of processes cleaning roles (-1 for all CPUs, default is None, i.e. this process only)
         progress_bar: print a progress bar (default is False)
 
     Returns:
@@ -455,6 +583,8 @@ def get_narratives(
         narrative_model["clean_text_options"]["tags_to_keep"],
         narrative_model["clean_text_options"]["remove_n_letter_words"],
         progress_bar=progress_bar,
+        tag_sentences=narrative_model["clean_text_options"].get("tag_sentences", False),
+        n_jobs=n_jobs,
     )
 
     final_statements = rename_arguments(postproc_roles, progress_bar, suffix="_highdim")
@@ -480,12 +610,18 @@ def get_narratives(
             used_roles=narrative_model["roles_with_entities"],
             top_n_entities=narrative_model["top_n_entities"],
             progress_bar=progress_bar,
+            sparse=True,
         )
 
-        for role in narrative_model["roles_with_entities"]:
-            for token, indices in entity_index[role].items():
-                for index in indices:
-                    final_statements[index][str(role + "_lowdim")] = token
+        entities = np.asarray(entity_index["entities"], dtype=object)
+        for role, matrix in entity_index["matrices"].items():
+            # the last entity (in the order of the entity list) found in a statement is kept
+            rows = np.flatnonzero(np.diff(matrix.indptr))
+            if len(rows) == 0:
+                continue
+            cols = np.maximum.reduceat(matrix.indices, matrix.indptr[rows])
+            for index, token in zip(rows, entities[cols]):
+                final_statements[index][str(role + "_lowdim")] = token
 
     # Embeddings
     if narrative_model["roles_with_embeddings"] is not None: